@@ -0,0 +1,345 @@
+#!/usr/bin/env python
+"""\
+Benchmarks for the conversion and client hot paths.
+
+Synthetic documents shaped like a Concur report list are generated at
+each requested size, and every case runs in a fresh child process so
+that its peak memory is measured in isolation.  For example:
+
+    python benchmarks/bench_concur.py --sizes 1K,1M,256M --save base.json
+    python benchmarks/bench_concur.py --sizes 1K,1M,256M --compare base.json
+
+For each case and size this records the best and median time per call,
+the throughput, the growth in peak resident memory, and the number and
+total size of the objects making up the result (a proxy for the
+allocations a conversion makes, since Python 2 has no allocation
+counter).  With --compare, cases that got slower than the threshold are
+reported and the exit status is 1.
+"""
+
+import BaseHTTPServer
+import json
+import multiprocessing
+import optparse
+import resource
+import subprocess
+import sys
+import threading
+import time
+import xml.etree.cElementTree as ET
+from os.path import abspath, dirname, join
+
+sys.path.insert(0, join(dirname(abspath(__file__)), '..'))
+import requests
+from concur import ConcurClient
+import concur._xml2json as x2j
+
+NAMESPACE = 'http://www.concursolutions.com/api/expense/expensereport/2011/03'
+
+RECORD = '''\
+  <ReportSummary>
+    <ReportName>Expenses for client visit %(i)d</ReportName>
+    <ReportId>n5oqVNsQ$soy2ftQuy$sU9o%(i)012d</ReportId>
+    <ReportCurrency>USD</ReportCurrency>
+    <ReportTotal>%(total).2f</ReportTotal>
+    <ApprovalStatusName>Approved</ApprovalStatusName>
+    <PaymentStatusName>Not Paid</PaymentStatusName>
+    <ReportDate>2013-06-%(day)02dT00:00:00</ReportDate>
+    <LastModifiedDate>2013-06-%(day)02dT10:15:00</LastModifiedDate>
+    <ReportDetailsURL>https://www.concursolutions.com/api/expense/expensereport/v2.0/report/n5oqVNsQ$soy2ftQuy$sU9o%(i)012d</ReportDetailsURL>
+  </ReportSummary>
+'''
+
+UNITS = {'K': 2 ** 10, 'M': 2 ** 20, 'G': 2 ** 30}
+
+
+def parse_size(text):
+    text = text.strip().upper()
+    if text[-1:] in UNITS:
+        return int(float(text[:-1]) * UNITS[text[-1]])
+    return int(text)
+
+
+def make_document(size):
+    '''Return an XML report list of at least 'size' bytes.'''
+    head = '<ReportsList xmlns="%s">\n' % NAMESPACE
+    tail = '</ReportsList>\n'
+    parts = [head]
+    length = len(head) + len(tail)
+    i = 0
+    while length < size:
+        record = RECORD % {'i': i, 'total': i * 1.25, 'day': i % 28 + 1}
+        parts.append(record)
+        length += len(record)
+        i += 1
+    parts.append(tail)
+    return ''.join(parts)
+
+
+def fake_response(body, content_type='application/xml'):
+    response = requests.models.Response()
+    response._content = body
+    response._content_consumed = True
+    response.status_code = 200
+    response.headers['content-type'] = content_type
+    response.url = ConcurClient.api_url + '/expense/expensereport/v2.0/Reports'
+    return response
+
+
+def serve(body, content_type='application/xml'):
+    '''Serve 'body' for every GET on a local port; return the base URL.'''
+    class Handler(BaseHTTPServer.BaseHTTPRequestHandler):
+        protocol_version = 'HTTP/1.1'
+
+        def log_message(self, *args):
+            pass
+
+        def do_GET(self):
+            self.send_response(200)
+            self.send_header('Content-Type', content_type)
+            self.send_header('Content-Length', str(len(body)))
+            self.end_headers()
+            self.wfile.write(body)
+
+    server = BaseHTTPServer.HTTPServer(('127.0.0.1', 0), Handler)
+    thread = threading.Thread(target=server.serve_forever)
+    thread.daemon = True
+    thread.start()
+    return 'http://127.0.0.1:%d' % server.server_port
+
+
+# Each case takes a document size and returns (function, bytes, operations).
+
+def case_elem_to_internal(size):
+    document = make_document(size)
+    root = ET.fromstring(document)
+    canonize = x2j.UsingPrefix(default_namespace=root)
+    return (lambda: x2j.elem_to_internal(root, canonize=canonize.fork()),
+            len(document), 1)
+
+def case_elem_to_internal_parallel(size):
+    document = make_document(size)
+    canonize = x2j.UsingPrefix(default_namespace=NAMESPACE)
+    pool = multiprocessing.Pool()
+    return (lambda: x2j.xml_to_internal_parallel(
+                document, canonize=canonize.fork(), pool=pool),
+            len(document), 1)
+
+def case_elem_to_compact(size):
+    document = make_document(size)
+    root = ET.fromstring(document)
+    canonize = x2j.UsingPrefix(default_namespace=root)
+    return (lambda: x2j.elem_to_compact(root, canonize=canonize.fork()),
+            len(document), 1)
+
+def case_internal_to_elem(size):
+    document = make_document(size)
+    root = ET.fromstring(document)
+    canonize = x2j.UsingPrefix(default_namespace=root)
+    internal = x2j.elem_to_internal(root, canonize=canonize.fork())
+    return (lambda: x2j.internal_to_elem(internal, canonize=canonize.fork()),
+            len(document), 1)
+
+def case_xml2json(size):
+    document = make_document(size)
+    return lambda: x2j.xml2json(document), len(document), 1
+
+def case_json2xml(size):
+    document = make_document(size)
+    json_data = x2j.xml2json(document)
+    return lambda: x2j.json2xml(json_data), len(json_data), 1
+
+def _names(size):
+    root = ET.fromstring(make_document(size))
+    return [elem.tag for elem in root.iter()]
+
+def case_encode(size):
+    names = _names(size)
+    canonize = x2j.UsingPrefix(default_namespace=NAMESPACE)
+    def run():
+        encode = canonize.fork().encode
+        for name in names:
+            encode(name)
+    return run, 0, len(names)
+
+def case_decode(size):
+    canonize = x2j.UsingPrefix(default_namespace=NAMESPACE)
+    names = [canonize.encode(name) for name in _names(size)]
+    def run():
+        decode = canonize.decode
+        for name in names:
+            decode(name)
+    return run, 0, len(names)
+
+def case_validate_response(size):
+    document = make_document(size)
+    client = ConcurClient(access_token='benchmark')
+    return (lambda: client.validate_response(fake_response(document)),
+            len(document), 1)
+
+def case_get(size):
+    document = make_document(size)
+    client = ConcurClient(access_token='benchmark')
+    client.api_url = serve(document)
+    return (lambda: client.get('expense/expensereport/v2.0/Reports'),
+            len(document), 1)
+
+CASES = [
+    ('elem_to_internal', case_elem_to_internal),
+    ('elem_to_internal_parallel', case_elem_to_internal_parallel),
+    ('elem_to_compact', case_elem_to_compact),
+    ('internal_to_elem', case_internal_to_elem),
+    ('xml2json', case_xml2json),
+    ('json2xml', case_json2xml),
+    ('encode', case_encode),
+    ('decode', case_decode),
+    ('validate_response', case_validate_response),
+    ('get', case_get),
+    ]
+
+
+def measure(obj):
+    '''Return the number and total size of the distinct objects in 'obj'.'''
+    seen = set()
+    count = size = 0
+    stack = [obj]
+    while stack:
+        obj = stack.pop()
+        if id(obj) in seen:
+            continue
+        seen.add(id(obj))
+        count += 1
+        size += sys.getsizeof(obj)
+        if isinstance(obj, dict):
+            stack.extend(obj.keys())
+            stack.extend(obj.values())
+        elif isinstance(obj, x2j.CompactRecord):
+            stack.extend(obj.values())
+        elif isinstance(obj, (list, tuple)):
+            stack.extend(obj)
+    return count, size
+
+
+def run_case(name, size, repeat, min_time=0.05):
+    '''Run one case in this process and return its measurements.'''
+    # The peak includes the input, as it would for a real caller.
+    base_rss = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    func, nbytes, ops = dict(CASES)[name](size)
+    objects, object_bytes = measure(func())
+    # Small documents are timed over enough calls to be measurable.
+    number = 1
+    while True:
+        start = time.time()
+        for i in xrange(number):
+            func()
+        elapsed = time.time() - start
+        if elapsed >= min_time:
+            break
+        number *= 10
+    times = [elapsed / number]
+    for i in range(repeat - 1):
+        start = time.time()
+        for i in xrange(number):
+            func()
+        times.append((time.time() - start) / number)
+    times.sort()
+    best = times[0]
+    return {
+        'case': name,
+        'size': size,
+        'best': best,
+        'median': times[len(times) // 2],
+        'MB/s': nbytes / best / 2 ** 20 if nbytes and best else None,
+        'ops/s': ops / best if best else None,
+        'peak_rss_kb': resource.getrusage(resource.RUSAGE_SELF).ru_maxrss - base_rss,
+        'objects': objects,
+        'object_kb': object_bytes // 1024,
+        }
+
+
+def run_isolated(name, size, repeat):
+    '''Run one case in a child process; return None if it failed (its
+traceback goes to stderr).'''
+    try:
+        output = subprocess.check_output([sys.executable, abspath(__file__),
+                                          '--child', name, str(size),
+                                          str(repeat)])
+    except subprocess.CalledProcessError:
+        return None
+    return json.loads(output)
+
+
+def report(result, baseline=None):
+    line = '%-25s %10d  best %9.4fs  median %9.4fs' % (
+        result['case'], result['size'], result['best'], result['median'])
+    if result['MB/s'] is not None:
+        line += '  %8.2f MB/s' % result['MB/s']
+    else:
+        line += '  %8.0f op/s' % result['ops/s']
+    line += '  rss +%dK  %d objects %dK' % (
+        result['peak_rss_kb'], result['objects'], result['object_kb'])
+    if baseline:
+        line += '  (%.2fx)' % (result['best'] / baseline['best'])
+    print line
+
+
+def main(argv=None):
+    p = optparse.OptionParser(
+        description='Benchmarks the conversion and client hot paths',
+        prog='bench_concur',
+        usage='%prog [--sizes 1K,1M] [--cases a,b] [--save F | --compare F]'
+    )
+    p.add_option('--sizes', default='1K,64K,1M',
+                 help='comma-separated document sizes, e.g. 1K,1M,256M')
+    p.add_option('--cases', help='comma-separated cases (default: all)')
+    p.add_option('--repeat', type='int', default=5)
+    p.add_option('--save', help='write the results to SAVE')
+    p.add_option('--compare', help='compare the results with COMPARE')
+    p.add_option('--threshold', type='float', default=0.10,
+                 help='slowdown reported as a regression (default 0.10)')
+    p.add_option('--child', nargs=3, help=optparse.SUPPRESS_HELP)
+    options, arguments = p.parse_args(argv)
+
+    if options.child:
+        name, size, repeat = options.child
+        print json.dumps(run_case(name, int(size), int(repeat)))
+        return 0
+
+    cases = options.cases.split(',') if options.cases else [c for c, f in CASES]
+    sizes = [parse_size(size) for size in options.sizes.split(',')]
+    baseline = {}
+    if options.compare:
+        with open(options.compare) as fp:
+            for result in json.load(fp):
+                baseline[result['case'], result['size']] = result
+
+    results = []
+    regressions = []
+    failures = []
+    for name in cases:
+        for size in sizes:
+            result = run_isolated(name, size, options.repeat)
+            if result is None:
+                print '%-25s %10d  failed' % (name, size)
+                failures.append('%s@%d' % (name, size))
+                continue
+            old = baseline.get((name, size))
+            report(result, old)
+            results.append(result)
+            if old and result['best'] > old['best'] * (1 + options.threshold):
+                regressions.append(result)
+
+    if options.save:
+        with open(options.save, 'w') as fp:
+            json.dump(results, fp, indent=1)
+    if regressions:
+        print '%d regression(s):' % len(regressions),
+        print ', '.join('%(case)s@%(size)d' % r for r in regressions)
+    if failures:
+        print '%d failure(s):' % len(failures), ', '.join(failures)
+    if regressions or failures:
+        return 1
+    return 0
+
+if __name__ == '__main__':
+    sys.exit(main())
@@ -1,7 +1,14 @@
+from collections import Mapping
+import functools
+import itertools
 import json
+from multiprocessing.pool import ThreadPool
+import threading
+import time
 import urllib
 import requests
 import types
+import zlib
 try:
     from cStringIO import StringIO
 except ImportError:
@@ -9,7 +16,27 @@ except ImportError:
 from xml.etree.cElementTree import ElementTree, register_namespace, fromstring
 import re
 
-from _xml2json import elem_to_internal, internal_to_elem, UsingPrefix
+from _xml2json import elem_to_internal, internal_to_elem, UsingPrefix, \
+    json_to_internal, namespace_of, compact, get_xml_parser
+from _jsonstream import iter_json_items, load_json
+from _metrics import Stats
+from _resilience import CircuitBreaker, Bulkhead, AdaptiveLimiter, \
+    PriorityScheduler, Deadline
+from _spool import MemoryBudget, spool
+from _expand import expand_report, everything
+
+# Use the fastest JSON decoder that is installed.
+try:
+    from ujson import loads as json_loads
+except ImportError:
+    try:
+        from simplejson import loads as json_loads
+    except ImportError:
+        json_loads = json.loads
+
+
+# Path segments that look like record IDs rather than resource names.
+_id_segment = re.compile(r'^(?:\d+|[^/]*[$%][^/]*|[\w-]{20,})$')
 
 
 class ConcurAPIError(Exception):
@@ -17,6 +44,35 @@ class ConcurAPIError(Exception):
     pass
 
 
+class ConcurCircuitOpenError(ConcurAPIError):
+    """Raised without sending a request while an endpoint's circuit is open."""
+    pass
+
+
+class ConcurOverloadedError(ConcurAPIError):
+    """Raised when a request is shed because an endpoint's queue is full."""
+    pass
+
+
+class ConcurDeadlineError(ConcurAPIError):
+    """Raised when a call's deadline passes before it completes."""
+    pass
+
+
+class ConcurCancelledError(ConcurDeadlineError):
+    """Raised when a call's deadline is cancelled before it completes."""
+    pass
+
+
+class _Flight(object):
+    '''A GET in progress, whose result is shared by identical requests.'''
+
+    def __init__(self):
+        self.done = threading.Event()
+        self.result = None
+        self.error = None
+
+
 class ConcurClient(object):
     """OAuth client for the Concur API"""
     api_url = "https://www.concursolutions.com/api"
@@ -26,15 +82,237 @@ class ConcurClient(object):
     #tokeninfo_url = "https://api.Concur-app.com/oauth/v1/tokeninfo"
 ##    authentication_scheme = "Bearer"
     authentication_scheme = "OAuth"
+    json_loads = staticmethod(json_loads)
+    # The root element of XML responses, by endpoint template.  With
+    # prefer_json, JSON results from these endpoints are wrapped in it so
+    # that they have the same shape as XML results; other JSON results are
+    # never wrapped.
+    json_roots = {
+        'expense/expensereport/v2.0/Reports': 'ReportsList',
+        'expense/expensereport/v2.0/report/{id}': 'ReportDetails',
+        'expense/expensereport/v1.1/report/{id}/entry/{id}':
+            'ReportEntryDetails',
+        'expense/expensereport/v2.0/report/{id}/entry/{id}/Attendees':
+            'AttendeesList',
+        'expense/expensereport/v1.0/quickexpense': 'QuickExpense',
+        'image/v1.0/report/{id}': 'Image',
+        'image/v1.0/expenseentry/{id}': 'Image',
+        }
+    # Sends requests; see concur._transport for alternatives.
+    transport = staticmethod(requests.request)
+    chunk_size = 64 * 1024
+    # The XML parser to use; see concur._xml2json.get_xml_parser.
+    xml_parser = 'auto'
+    accept_encoding = 'gzip, deflate'
+    # Request bodies of this many bytes or more are sent gzipped; None (the
+    # default) never compresses.  gzip_endpoints overrides it for an
+    # endpoint template: a size turns compression on there, and False
+    # turns it off, as does a 415 answer to a compressed body.
+    compress_min_size = None
+    compress_level = 6
+    # JSON bodies bigger than this, or than what is left of the client's
+    # memory budget, are read into a temporary file; see concur._spool.
+    spool_threshold = 16 * 2 ** 20
+    memory_budget = None
+    hook_events = ('before_request', 'after_response', 'on_error', 'on_retry')
+    # Failed requests are retried only if these allow it.
+    max_retries = 0
+    retry_methods = ('GET', 'HEAD', 'OPTIONS')
+    retry_statuses = (429, 500, 502, 503, 504)
+    retry_backoff = 0.5
+    # Per-endpoint circuit breakers (off when the threshold is 0) and
+    # limits on requests in flight (off when None); see concur._resilience.
+    breaker_threshold = 0
+    breaker_reset = 30.0
+    breaker_probes = 1
+    max_in_flight = None
+    max_queued = 0
+    queue_timeout = None
+    # An AdaptiveLimiter for the requests in flight to all endpoints.
+    limiter = None
+    # A PriorityScheduler, and the class of requests not given a _priority.
+    scheduler = None
+    default_priority = 'interactive'
+    # Identical GETs made while one is in flight share its result.
+    coalesce = True
+    # The seconds a call may take in all, retries included; None for no
+    # limit.  Calls may also be given a Deadline; see concur._resilience.
+    timeout = None
 
     def __init__(self, client_id=None, client_secret=None,
-                 access_token=None, use_app=False):
+                 access_token=None, use_app=False, prefer_json=False):
 
         self.client_id = client_id
         self.client_secret = client_secret
         self.access_token = access_token
         self.auth_url = self.app_auth_url if use_app else self.web_auth_uri
         self.use_app = use_app
+        self.prefer_json = prefer_json
+        # What each endpoint returned when JSON was requested.
+        self.json_endpoints = {}
+        # Per-endpoint overrides of compress_min_size.
+        self.gzip_endpoints = {}
+        self._canonizers = {}
+        self._canonizers_lock = threading.Lock()
+        self.hooks = dict((event, []) for event in self.hook_events)
+        self.stats = Stats()
+        self.memory = MemoryBudget(self.memory_budget)
+        self.payload_validators = {}
+        self.breakers = {}
+        self.bulkheads = {}
+        self._guards_lock = threading.Lock()
+        self._flights = {}
+        self._flights_lock = threading.Lock()
+
+    def register_validator(self, path, validator):
+        '''Check payloads posted to an endpoint before sending them.
+
+'validator' is called with the keyword arguments given to post() (other
+than those starting with '_') and should raise an exception if they are
+not valid.'''
+        self.payload_validators[self.endpoint_template(path)] = validator
+
+    def add_hook(self, event, hook):
+        '''Call 'hook' with keyword arguments describing each 'event'.
+
+before_request hooks receive method, url, endpoint, params, headers and
+data, and may modify the headers; after_response hooks receive method,
+url, endpoint and response; on_error hooks receive method, url, endpoint,
+error and (if there was one) response; on_retry hooks receive method,
+url, endpoint, attempt, delay and either error or response.'''
+        if event not in self.hooks:
+            raise ValueError('unknown event: %r' % event)
+        self.hooks[event].append(hook)
+
+    def remove_hook(self, event, hook):
+        self.hooks[event].remove(hook)
+
+    def fire(self, event, **info):
+        for hook in self.hooks[event]:
+            hook(**info)
+
+    def retry_delay(self, attempt, response=None):
+        '''Return the seconds to wait before retrying, honoring Retry-After.'''
+        if response is not None:
+            try:
+                return float(response.headers['retry-after'])
+            except (KeyError, ValueError):
+                pass
+        return self.retry_backoff * 2 ** attempt
+
+    def deadline(self, deadline=None):
+        '''Return the Deadline for a call given a Deadline, a number of
+seconds or None, bounded by the client's timeout.'''
+        deadline = Deadline.coerce(deadline)
+        if self.timeout is None:
+            return deadline
+        if deadline is None:
+            return Deadline(self.timeout)
+        return deadline.within(self.timeout)
+
+    def deadline_error(self, deadline, endpoint, reason=None):
+        if deadline.cancelled:
+            message = 'Cancelled: %s' % endpoint
+            error_class = ConcurCancelledError
+        else:
+            message = 'Deadline passed: %s' % endpoint
+            error_class = ConcurDeadlineError
+        if reason is not None:
+            message = '%s (%s)' % (message, reason)
+        return error_class(message)
+
+    def iter_body(self, response, deadline=None, endpoint=None):
+        '''Iterate over the chunks of a response body, giving up if
+'deadline' passes or is cancelled.'''
+        chunks = response.iter_content(self.chunk_size)
+        if deadline is None:
+            return chunks
+        return self._bounded(chunks, response, deadline,
+                             endpoint or self.endpoint_template(response.url))
+
+    def _bounded(self, chunks, response, deadline, endpoint):
+        try:
+            for chunk in chunks:
+                if deadline.done:
+                    break
+                yield chunk
+            else:
+                # Cancelling closes the response, which can look like
+                # the end of the body.
+                if not deadline.cancelled:
+                    return
+        except Exception as error:
+            if not deadline.done:
+                raise
+            reason = error
+        else:
+            reason = None
+        response.close()
+        raise self.deadline_error(deadline, endpoint, reason)
+
+    def breaker(self, endpoint):
+        '''Return the CircuitBreaker for an endpoint, or None if disabled.'''
+        if not self.breaker_threshold:
+            return None
+        try:
+            return self.breakers[endpoint]
+        except KeyError:
+            with self._guards_lock:
+                if endpoint not in self.breakers:
+                    self.breakers[endpoint] = CircuitBreaker(
+                        self.breaker_threshold, self.breaker_reset,
+                        self.breaker_probes)
+                return self.breakers[endpoint]
+
+    def bulkhead(self, endpoint):
+        '''Return the Bulkhead for an endpoint, or None if unlimited.'''
+        if self.max_in_flight is None:
+            return None
+        try:
+            return self.bulkheads[endpoint]
+        except KeyError:
+            with self._guards_lock:
+                if endpoint not in self.bulkheads:
+                    self.bulkheads[endpoint] = Bulkhead(
+                        self.max_in_flight, self.max_queued,
+                        self.queue_timeout)
+                return self.bulkheads[endpoint]
+
+    def canonizer(self, endpoint, default_namespace):
+        '''Return the shared UsingPrefix for an endpoint and namespace.
+
+Call its fork() method to get an instance for a single document.'''
+        key = endpoint, default_namespace
+        try:
+            return self._canonizers[key]
+        except KeyError:
+            with self._canonizers_lock:
+                if key not in self._canonizers:
+                    self._canonizers[key] = UsingPrefix(
+                        default_namespace=default_namespace)
+                return self._canonizers[key]
+
+    def endpoint_template(self, url):
+        '''Reduce a URL or API path to the endpoint it addresses, such as
+"expense/expensereport/v2.0/report/{id}".
+
+Only segments that look like IDs are replaced, so calls to paths ending
+in codes or names should give the template with '_endpoint' instead;
+otherwise each code gets stats, a breaker and a bulkhead of its own.'''
+        if url.startswith(self.api_url):
+            url = url[len(self.api_url):]
+        path = url.split('?', 1)[0].strip('/')
+        return '/'.join('{id}' if _id_segment.match(segment) else segment
+                        for segment in path.split('/'))
+
+    def accept_header(self, path, endpoint=None):
+        '''Return the Accept header to send to an endpoint, if any.'''
+        if not self.prefer_json:
+            return None
+        if self.json_endpoints.get(endpoint or self.endpoint_template(path),
+                                   True):
+            return 'application/json, application/xml;q=0.9'
+        return 'application/xml'
 
     def build_oauth_url(self, redirect_uri=None, scope="EXPRPT", state=None):
         params = {
@@ -78,25 +356,108 @@ class ConcurClient(object):
             except:
                 raise ConcurAPIError(response)
 
-    def validate_response(self, response):
+    def validate_response(self, response, decode='parse', deadline=None,
+                          endpoint=None):
+        '''Check a response and return a (content_type, parsed) tuple.
 
+'decode' selects what is returned as the parsed value: 'parse' (the
+default) decodes the whole body; 'compact' does too, but with
+CompactRecords (see concur._xml2json) in place of dictionaries below the
+root; 'stream' returns an iterator over the items of a JSON list,
+decoded as they arrive; 'raw' returns the body bytes unchanged.
+
+XML is parsed as the body is read (and decompressed), if the response
+has not been read already.  Reading stops if 'deadline' passes or is
+cancelled.  'endpoint' is the endpoint template, if not the one
+endpoint_template() makes of the URL.'''
         content_type = response.headers['content-type']
+        endpoint = endpoint or self.endpoint_template(response.url)
+        if self.prefer_json:
+            self.json_endpoints[endpoint] = 'json' in content_type
+        if decode == 'raw':
+            if 'xml' in content_type:
+                return 'xml', response.content
+            if 'json' in content_type:
+                return 'json', response.content
+            return 'raw', response.content
         if 'xml' in content_type:
-            root = fromstring(response.content)
-            if root.tag.lower() == 'error':
-                raise ConcurAPIError(root.find('Message').text)
-            return 'xml', elem_to_internal(root,
-                canonize=UsingPrefix(default_namespace=root),
-                )
+            if getattr(response, '_content_consumed', False):
+                chunks = [response.content]
+            else:
+                chunks = self.iter_body(response, deadline, endpoint)
+            try:
+                root_tag, parsed = get_xml_parser(self.xml_parser).to_internal(
+                    chunks,
+                    lambda tag: self.canonizer(endpoint,
+                                               namespace_of(tag)).fork(),
+                    compact=(decode == 'compact'),
+                    timer=functools.partial(self.stats.timer, endpoint),
+                    )
+            finally:
+                response.close()
+            if root_tag.lower() == 'error':
+                error, = parsed.values()
+                message = error.get('Message') if error else None
+                if isinstance(message, Mapping):
+                    message = message.get('#text')
+                raise ConcurAPIError(message)
+            return 'xml', parsed
         if 'json' in content_type:
-            return 'json', json.loads(response.content)
+            if decode == 'stream':
+                items = iter_json_items(
+                    self.iter_body(response, deadline, endpoint))
+                if self.prefer_json:
+                    items = itertools.imap(json_to_internal, items)
+                return 'json', items
+            if getattr(response, '_content_consumed', False):
+                body = spool([response.content])
+            else:
+                with self.stats.timer(endpoint, 'download'):
+                    body = spool(self.iter_body(response, deadline, endpoint),
+                                 self.spool_threshold, self.memory)
+            try:
+                with self.stats.timer(endpoint, 'parse'):
+                    if body.spilled:
+                        parsed = load_json(body.iter_chunks(self.chunk_size))
+                    else:
+                        parsed = self.json_loads(body.getvalue())
+            finally:
+                body.close()
+            if self.prefer_json:
+                with self.stats.timer(endpoint, 'convert'):
+                    parsed = json_to_internal(
+                        parsed, root=self.json_roots.get(endpoint))
+            if decode == 'compact':
+                with self.stats.timer(endpoint, 'convert'):
+                    if isinstance(parsed, dict) and len(parsed) == 1:
+                        parsed = dict((k, compact(v))
+                                      for k, v in parsed.items())
+                    else:
+                        parsed = compact(parsed)
+            return 'json', parsed
         raise ConcurAPIError('unknown content-type: %s' % content_type)
 
     def api(self, path, method='GET', **kwargs):
+        return self._call(path, method, **kwargs)[0]
 
+    def _call(self, path, method='GET', **kwargs):
+        '''Make a request; return the response and what 'consume' made of it.
+
+'consume', if given, is called with a successful response while the
+request still holds its slots, so that a body that fails to arrive is
+retried and counts against the breaker like any other failure.'''
         params = kwargs['params'] if 'params' in kwargs else {}
         data = kwargs['data'] if 'data' in kwargs else {}
         headers = kwargs['headers'] if 'headers' in kwargs else {}
+        stream = kwargs['stream'] if 'stream' in kwargs else False
+        consume = kwargs['consume'] if 'consume' in kwargs else None
+        priority = kwargs['priority'] if 'priority' in kwargs else None
+        priority = priority or self.default_priority
+        deadline = kwargs['deadline'] if 'deadline' in kwargs else None
+        endpoint = kwargs['endpoint'] if 'endpoint' in kwargs else None
+        endpoint = endpoint or self.endpoint_template(path)
+        if deadline is None and self.timeout is not None:
+            deadline = Deadline(self.timeout)
 
         if not self.access_token and 'access_token' not in params:
             raise ConcurAPIError("You must provide a valid access token.")
@@ -110,38 +471,319 @@ class ConcurClient(object):
             access_token = self.access_token
 
         headers['Authorization'] = '%s %s' % (self.authentication_scheme, access_token)
+        accept = self.accept_header(path, endpoint)
+        if accept:
+            headers.setdefault('Accept', accept)
+        if self.accept_encoding:
+            headers.setdefault('Accept-Encoding', self.accept_encoding)
 
-        resp = requests.request(method, url,
-                                params=params,
-                                headers=headers,
-                                data=data,
-                                )
-        if str(resp.status_code)[0] not in ('2', '3'):
-            print 'method =', method
-            print 'url =', url
-            print 'params =', params
-            print 'headers =', headers
-            print 'data =', data
-            print
-            raise ConcurAPIError("Error returned via the API with status code (%s):" %
-                                resp.status_code, resp.text)
-        return resp
+        plain = data
+        min_size = self.gzip_endpoints.get(endpoint, self.compress_min_size)
+        if (min_size is not None and min_size is not False and
+                isinstance(data, str) and len(data) >= min_size):
+            compressor = zlib.compressobj(self.compress_level, zlib.DEFLATED,
+                                          16 + zlib.MAX_WBITS)
+            data = compressor.compress(data) + compressor.flush()
+            headers['Content-Encoding'] = 'gzip'
+        breaker = self.breaker(endpoint)
+        bulkhead = self.bulkhead(endpoint)
+        scheduler = self.scheduler
+        start = time.time()
+        attempt = 0
+        result = None
+        while True:
+            if deadline is not None and deadline.done:
+                error = self.deadline_error(deadline, endpoint)
+                self.fire('on_error', method=method, url=url,
+                          endpoint=endpoint, error=error, response=None)
+                raise error
+            self.fire('before_request', method=method, url=url,
+                      endpoint=endpoint, params=params, headers=headers,
+                      data=data)
+            retry = attempt < self.max_retries and method in self.retry_methods
+            if scheduler is not None and not scheduler.acquire(
+                    priority, deadline=deadline):
+                error = self.deadline_error(deadline, endpoint)
+                self.fire('on_error', method=method, url=url,
+                          endpoint=endpoint, error=error, response=None)
+                raise error
+            if bulkhead is not None and not bulkhead.acquire(
+                    deadline=deadline):
+                if scheduler is not None:
+                    scheduler.release(priority)
+                if deadline is not None and deadline.done:
+                    error = self.deadline_error(deadline, endpoint)
+                else:
+                    error = ConcurOverloadedError(
+                        'Too many requests queued for %s' % endpoint)
+                self.fire('on_error', method=method, url=url,
+                          endpoint=endpoint, error=error, response=None)
+                raise error
+            try:
+                if breaker is not None and not breaker.allow():
+                    error = ConcurCircuitOpenError(
+                        'Circuit open for %s; retry in %.1fs' %
+                        (endpoint, breaker.retry_in()))
+                    self.fire('on_error', method=method, url=url,
+                              endpoint=endpoint, error=error, response=None)
+                    raise error
+                limiter = self.limiter
+                if limiter is not None and not limiter.acquire(
+                        deadline=deadline):
+                    if breaker is not None:
+                        breaker.record(None)
+                    error = self.deadline_error(deadline, endpoint)
+                    self.fire('on_error', method=method, url=url,
+                              endpoint=endpoint, error=error, response=None)
+                    raise error
+                if deadline is not None and deadline.done:
+                    # It ran out while this call waited for its slots.
+                    if limiter is not None:
+                        limiter.release(None)
+                    if breaker is not None:
+                        breaker.record(None)
+                    error = self.deadline_error(deadline, endpoint)
+                    self.fire('on_error', method=method, url=url,
+                              endpoint=endpoint, error=error, response=None)
+                    raise error
+                ok = False
+                resp = None
+                try:
+                    resp = self.transport(method, url,
+                                          params=params,
+                                          headers=headers,
+                                          data=data,
+                                          stream=True,
+                                          timeout=(deadline and
+                                                   deadline.remaining()),
+                                          )
+                    if deadline is not None:
+                        deadline.track(resp)
+                    elapsed = resp.elapsed.total_seconds()
+                    ok = resp.status_code not in self.retry_statuses
+                    self.stats.add(endpoint, 'server', elapsed)
+                    if not stream:
+                        with self.stats.timer(endpoint, 'download'):
+                            try:
+                                resp.content
+                            except Exception as error:
+                                if deadline is None or not deadline.cancelled:
+                                    raise
+                                # Cancelling closed the response under us.
+                                raise requests.ConnectionError(error)
+                    if (consume is not None and
+                            str(resp.status_code)[0] in ('2', '3')):
+                        result = consume(resp)
+                except requests.RequestException:
+                    ok = False
+                    # A cancelled call tells nothing about the server.
+                    if deadline is not None and deadline.cancelled:
+                        ok = None
+                    if breaker is not None:
+                        breaker.record(ok)
+                    raise
+                except Exception as error:
+                    # The server answered, but the body was unusable or the
+                    # call was given up while reading it.
+                    if deadline is not None and deadline.done:
+                        ok = None
+                    if breaker is not None:
+                        breaker.record(ok)
+                    self.stats.add(endpoint, 'total', time.time() - start)
+                    self.fire('on_error', method=method, url=url,
+                              endpoint=endpoint, error=error, response=resp)
+                    raise
+                finally:
+                    if limiter is not None:
+                        limiter.release(ok, elapsed if ok else None,
+                                        endpoint)
+                if breaker is not None:
+                    breaker.record(resp.status_code not in self.retry_statuses)
+            except requests.RequestException as error:
+                if deadline is not None and deadline.done:
+                    error = self.deadline_error(deadline, endpoint, error)
+                    self.fire('on_error', method=method, url=url,
+                              endpoint=endpoint, error=error, response=None)
+                    raise error
+                if not retry:
+                    self.fire('on_error', method=method, url=url,
+                              endpoint=endpoint, error=error, response=None)
+                    raise
+                delay = self.retry_delay(attempt)
+                failure = dict(error=error)
+            else:
+                self.fire('after_response', method=method, url=url,
+                          endpoint=endpoint, response=resp)
+                if str(resp.status_code)[0] in ('2', '3'):
+                    break
+                if resp.status_code == 415 and data is not plain:
+                    # Send it again, uncompressed.
+                    self.gzip_endpoints[endpoint] = False
+                    data = plain
+                    del headers['Content-Encoding']
+                    resp.close()
+                    continue
+                if not retry or resp.status_code not in self.retry_statuses:
+                    error = ConcurAPIError(
+                        "Error returned via the API with status code (%s):" %
+                        resp.status_code, resp.text)
+                    self.fire('on_error', method=method, url=url,
+                              endpoint=endpoint, error=error, response=resp)
+                    raise error
+                resp.close()
+                delay = self.retry_delay(attempt, resp)
+                failure = dict(response=resp)
+            finally:
+                if bulkhead is not None:
+                    bulkhead.release()
+                if scheduler is not None:
+                    scheduler.release(priority)
+            attempt += 1
+            remaining = deadline and deadline.remaining()
+            if remaining is not None and remaining < delay:
+                error = self.deadline_error(
+                    deadline, endpoint, 'retry in %.1fs' % delay)
+                self.fire('on_error', method=method, url=url,
+                          endpoint=endpoint, error=error,
+                          response=failure.get('response'))
+                raise error
+            self.fire('on_retry', method=method, url=url, endpoint=endpoint,
+                      attempt=attempt, delay=delay, **failure)
+            if deadline is None:
+                time.sleep(delay)
+            else:
+                deadline.wait(delay)
+        self.stats.add(endpoint, 'total', time.time() - start)
+        return resp, result
 
     def get(self, path, **params):
-        content_type, parsed = self.validate_response(
-            self.api(path, 'GET', params=params))
+        '''GET a path and return the decoded response.
+
+Unless 'coalesce' is false, a GET made while an identical one (same path,
+parameters, decoding, token and priority) is in flight waits for that one
+and gets the same result object, so results should be treated as
+read-only.  Streams are never shared.
+
+'_priority' names the scheduler class of the request (see scheduler).
+'_deadline' is a Deadline or a number of seconds, which bounds the call
+together with the client's timeout.  '_endpoint' is the endpoint
+template of the path, if endpoint_template() cannot tell it.'''
+        decode = params.pop('_decode', 'parse')
+        priority = params.pop('_priority', None)
+        deadline = self.deadline(params.pop('_deadline', None))
+        endpoint = params.pop('_endpoint', None)
+        if not self.coalesce or decode == 'stream':
+            return self._get(path, params, decode, priority, deadline,
+                             endpoint)
+        # An interactive call must not wait on a bulk one.
+        key = (path, decode, params.get('access_token', self.access_token),
+               priority or self.default_priority,
+               repr(sorted(params.items())))
+        with self._flights_lock:
+            flight = self._flights.get(key)
+            leader = flight is None
+            if leader:
+                flight = self._flights[key] = _Flight()
+        if not leader:
+            if deadline is None:
+                flight.done.wait()
+            elif not deadline.wait_for(flight.done):
+                raise self.deadline_error(
+                    deadline, endpoint or self.endpoint_template(path))
+            if isinstance(flight.error, ConcurDeadlineError):
+                # The other call ran out of time, but this one has not.
+                return self._get(path, params, decode, priority, deadline,
+                                 endpoint)
+            if flight.error is not None:
+                raise flight.error
+            return flight.result
+        try:
+            flight.result = self._get(path, params, decode, priority,
+                                      deadline, endpoint)
+        except Exception as error:
+            flight.error = error
+            raise
+        finally:
+            with self._flights_lock:
+                del self._flights[key]
+            flight.done.set()
+        return flight.result
+
+    def _get(self, path, params, decode, priority=None, deadline=None,
+             endpoint=None):
+        endpoint = endpoint or self.endpoint_template(path)
+        resp, (content_type, parsed) = self._call(
+            path, 'GET', params=params, stream=(decode != 'raw'),
+            priority=priority, deadline=deadline, endpoint=endpoint,
+            consume=lambda response: self.validate_response(
+                response, decode=decode, deadline=deadline,
+                endpoint=endpoint))
         return parsed
 
+    def get_many(self, requests, workers=8, errors='raise', priority=None,
+                 deadline=None):
+        '''GET many paths concurrently, returning the results in order.
+
+Each request is a path or a (path, params) pair.  With errors='raise',
+the first failure is raised once all requests have finished; with
+errors='return', the exception takes the place of the result.
+'priority' is the scheduler class of the requests.  'deadline' (a
+Deadline or a number of seconds) bounds the whole batch; once it passes
+or is cancelled, requests not yet sent fail at once with
+ConcurDeadlineError, and those in flight are given up.'''
+        requests = [(r, {}) if isinstance(r, basestring) else r
+                    for r in requests]
+        deadline = Deadline.coerce(deadline)
+        if priority is not None or deadline is not None:
+            options = dict(_priority=priority, _deadline=deadline)
+            requests = [(path, dict(params, **options))
+                        for path, params in requests]
+        def fetch(request):
+            path, params = request
+            if deadline is not None and deadline.done:
+                return self.deadline_error(
+                    deadline,
+                    params.get('_endpoint') or self.endpoint_template(path))
+            try:
+                return self.get(path, **params)
+            except Exception as error:
+                return error
+        pool = ThreadPool(max(1, min(workers, len(requests))))
+        try:
+            results = pool.map(fetch, requests)
+        finally:
+            pool.close()
+        if errors == 'raise':
+            for result in results:
+                if isinstance(result, Exception):
+                    raise result
+        return results
+
+    def expand_report(self, report_id, include=everything, workers=8,
+                      priority=None, deadline=None):
+        '''Fetch a report with its entries, attendees and images in a few
+parallel waves; see concur._expand.expand_report.'''
+        return expand_report(self, report_id, include, workers, priority,
+                             deadline)
+
     def post(self, path, **data):
         params = data.pop('_params', {})
+        decode = data.pop('_decode', 'parse')
+        priority = data.pop('_priority', None)
+        deadline = self.deadline(data.pop('_deadline', None))
+        endpoint = data.pop('_endpoint', None) or self.endpoint_template(path)
+        validator = self.payload_validators.get(endpoint)
+        if validator is not None:
+            validator(dict((k, v) for k, v in data.items() if k[:1] != '_'))
         if '_xmlns' in data:
             headers = { 'content-type': 'application/xml' }
             elem = ElementTree(
                 internal_to_elem(
                     data,
-                    canonize=UsingPrefix(
-                        default_namespace=data.pop('_xmlns'),
-                        ),
+                    canonize=self.canonizer(
+                        endpoint,
+                        data.pop('_xmlns'),
+                        ).fork(),
                     ),
                 )
             data = StringIO()
@@ -149,19 +791,25 @@ class ConcurClient(object):
             data = data.getvalue()
         else:
             headers = {}
-        content_type, parsed = self.validate_response(
-            self.api(path, 'POST',
-                     params=params,
-                     headers=headers,
-                     data=data,
-                     ))
+        resp, (content_type, parsed) = self._call(
+            path, 'POST',
+            params=params,
+            headers=headers,
+            data=data,
+            stream=(decode != 'raw'),
+            priority=priority,
+            deadline=deadline,
+            endpoint=endpoint,
+            consume=lambda response: self.validate_response(
+                response, decode=decode, deadline=deadline,
+                endpoint=endpoint),
+            )
         return parsed
 
     def __getattr__(self, name):
         '''\
 Turn method calls such as "Concur.foo_bar(...)" into
-"Concur.api('/foo/bar', 'GET', params={...})", and then parse the
-response.
+"Concur.get('foo/bar', ...)".
 '''
         base_path = name.replace('_', '/')
 
@@ -170,9 +818,7 @@ response.
             'Accesses the /%s API endpoints.'
             path = list(path)
             path.insert(0, base_path)
-            return self.parse_response(
-                self.api('/'.join(path), 'GET', params=params)
-                )
+            return self.get('/'.join(path), **params)
 
         # Clone a new method with the correct name and doc string.
         retval = types.FunctionType(
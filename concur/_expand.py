@@ -0,0 +1,141 @@
+"""Fetching an expense report together with everything hanging off it.
+
+expand_report() resolves the calls needed for a complete picture of one
+report in parallel waves, each made with ConcurClient.get_many():
+
+    1. the report, with its list of entries, and the report's image
+    2. each entry's details (with its itemizations), attendees and image
+    3. each distinct attendee type named by the attendees
+
+so a report with a dozen entries takes three round trips rather than
+dozens.  The paths are in 'paths' and can be changed to suit other API
+versions; their endpoint templates (see ConcurClient.endpoint_template)
+are made by filling in 'placeholders', so that, for example, every
+attendee type code shares one template.
+"""
+
+from _resilience import Deadline
+from _xml2json import as_list, unwrap
+
+paths = {
+    'report': 'expense/expensereport/v2.0/report/%(report)s',
+    'report_image': 'image/v1.0/report/%(report)s',
+    'entry': 'expense/expensereport/v1.1/report/%(report)s/entry/%(entry)s',
+    'attendees': 'expense/expensereport/v2.0/report/%(report)s/entry/%(entry)s/Attendees',
+    'entry_image': 'image/v1.0/expenseentry/%(entry)s',
+    'attendee_type': 'v3.0/expense/attendeetypes/%(type)s',
+    }
+placeholders = {'report': '{id}', 'entry': '{id}', 'type': '{code}'}
+
+everything = ('entries', 'attendees', 'attendee_types', 'images')
+
+
+def _children(record, list_tag, tag):
+    container = record.get(list_tag) if record else None
+    return as_list(container.get(tag)) if container else []
+
+
+class _Wave(object):
+    '''Requests to be made together, each with a slot for its result.'''
+
+    def __init__(self):
+        self.requests = []
+        self.slots = []
+
+    def add(self, name, ids, target, key):
+        '''Request paths[name] filled in with 'ids' into target[key].'''
+        self.requests.append((paths[name] % ids,
+                              {'_endpoint': paths[name] % placeholders}))
+        self.slots.append((target, key))
+
+    def run(self, client, workers, errors, priority, deadline):
+        if not self.requests:
+            return
+        results = client.get_many(self.requests, workers=workers,
+                                  errors='return', priority=priority,
+                                  deadline=deadline)
+        for (path, params), (target, key), result in zip(
+                self.requests, self.slots, results):
+            if isinstance(result, Exception):
+                errors[path] = result
+                result = None
+            else:
+                result = unwrap(result)
+            target[key] = result
+
+
+def expand_report(client, report_id, include=everything, workers=8,
+                  priority=None, deadline=None):
+    '''Return a report with its entries, attendees and images.
+
+'include' names what to fetch beyond the report itself: 'entries' (each
+entry's details and itemizations), 'attendees', 'attendee_types' and
+'images'.  The result is a dictionary:
+
+    report          the report's details
+    image           the report's image, if requested
+    entries         for each entry: the entry from the report ('summary'),
+                    and as requested its 'details', 'itemizations',
+                    'attendees' and 'image'
+    attendee_types  each attendee type used, by code
+    errors          the exception raised for each path that failed, whose
+                    result is None
+
+The report itself is fetched first, and if that fails its exception is
+raised.  'priority' is the scheduler class of the requests, and
+'deadline' (a Deadline or a number of seconds) bounds all the waves
+together.'''
+    include = set(include)
+    deadline = Deadline.coerce(deadline)
+    unknown = include - set(everything)
+    if unknown:
+        raise ValueError('cannot include %s' % ', '.join(sorted(unknown)))
+    ids = {'report': report_id}
+    result = {'entries': [], 'attendee_types': {}, 'errors': {}}
+    errors = result['errors']
+
+    wave = _Wave()
+    wave.add('report', ids, result, 'report')
+    if 'images' in include:
+        wave.add('report_image', ids, result, 'image')
+    wave.run(client, workers, errors, priority, deadline)
+    if result['report'] is None:
+        raise errors[paths['report'] % ids]
+
+    wave = _Wave()
+    for summary in _children(result['report'], 'ExpenseEntriesList',
+                             'ExpenseEntry'):
+        entry = {'summary': summary}
+        result['entries'].append(entry)
+        ids['entry'] = summary.get('ReportEntryID')
+        if ids['entry'] is None:
+            continue
+        if 'entries' in include:
+            wave.add('entry', ids, entry, 'details')
+        if include & set(['attendees', 'attendee_types']):
+            wave.add('attendees', ids, entry, 'attendees')
+        if 'images' in include:
+            wave.add('entry_image', ids, entry, 'image')
+    wave.run(client, workers, errors, priority, deadline)
+
+    types = result['attendee_types']
+    wave = _Wave()
+    for entry in result['entries']:
+        if 'details' in entry:
+            entry['itemizations'] = _children(
+                entry['details'], 'ItemizationsList', 'Itemization')
+        if 'attendees' in entry:
+            attendees = entry['attendees']
+            entry['attendees'] = as_list(
+                attendees.get('Attendee') if attendees else None)
+            for attendee in entry['attendees']:
+                code = attendee.get('AttendeeTypeCode')
+                if (code and 'attendee_types' in include and
+                        code not in types):
+                    types[code] = None
+                    wave.add('attendee_type', {'type': code}, types, code)
+    wave.run(client, workers, errors, priority, deadline)
+    if 'attendees' not in include:
+        for entry in result['entries']:
+            entry.pop('attendees', None)
+    return result
@@ -0,0 +1,133 @@
+"""Incremental decoding of large JSON documents.
+
+iter_json_items() reads a document one chunk at a time and yields the
+elements of an array as soon as each one is complete, so a list with
+many thousands of reports never has to be held as a single string.
+"""
+
+import json
+import re
+
+_whitespace = re.compile(r'[ \t\n\r]*')
+_decoder = json.JSONDecoder()
+
+
+class _Buffer(object):
+    '''A sliding window over an iterable of chunks.'''
+
+    def __init__(self, chunks, decoder):
+        self.chunks = iter(chunks)
+        self.decoder = decoder
+        self.buf = ''
+        self.pos = 0
+
+    def fill(self):
+        '''Append the next non-empty chunk, discarding consumed input.
+Returns False at the end of the input.'''
+        for chunk in self.chunks:
+            if chunk:
+                self.buf = self.buf[self.pos:] + chunk
+                self.pos = 0
+                return True
+        return False
+
+    def skip(self):
+        '''Skip whitespace and return the next character ('' at EOF).'''
+        while True:
+            self.pos = _whitespace.match(self.buf, self.pos).end()
+            if self.pos < len(self.buf):
+                return self.buf[self.pos]
+            if not self.fill():
+                return ''
+
+    def expect(self, chars):
+        c = self.skip()
+        if not c or c not in chars:
+            raise ValueError('expected one of %r at offset %d, found %r' %
+                             (chars, self.pos, c))
+        self.pos += 1
+        return c
+
+    def value(self):
+        '''Decode one complete JSON value.'''
+        self.skip()
+        while True:
+            try:
+                obj, end = self.decoder.raw_decode(self.buf, self.pos)
+            except ValueError:
+                if self.fill():
+                    continue
+                raise
+            # A number ending exactly at the end of the buffer may
+            # continue in the next chunk.
+            if end == len(self.buf) and self.fill():
+                continue
+            self.pos = end
+            return obj
+
+
+def iter_json_items(chunks, key=None, decoder=None):
+    '''Yield the elements of a JSON array, one at a time.
+
+If the document is an array, its elements are yielded.  If it is an
+object, the elements of the member named 'key' are yielded; when 'key'
+is None, the first member whose value is an array is used and the
+members before it are discarded.  'chunks' is any iterable of strings,
+such as the result of response.iter_content().'''
+    buf = _Buffer(chunks, decoder or _decoder)
+    if buf.expect('[{') == '{':
+        while True:
+            if buf.skip() == '}':
+                return
+            name = buf.value()
+            buf.expect(':')
+            if (key is None or name == key) and buf.skip() == '[':
+                buf.pos += 1
+                break
+            buf.value()
+            if buf.expect(',}') == '}':
+                return
+    if buf.skip() == ']':
+        return
+    while True:
+        yield buf.value()
+        if buf.expect(',]') == ']':
+            return
+
+
+def _load(buf, depth):
+    c = buf.skip()
+    if depth <= 0 or not c or c not in '[{':
+        return buf.value()
+    buf.pos += 1
+    if c == '[':
+        result = []
+        if buf.skip() == ']':
+            buf.pos += 1
+            return result
+        while True:
+            result.append(_load(buf, depth - 1))
+            if buf.expect(',]') == ']':
+                return result
+    result = {}
+    if buf.skip() == '}':
+        buf.pos += 1
+        return result
+    while True:
+        name = buf.value()
+        buf.expect(':')
+        result[name] = _load(buf, depth - 1)
+        if buf.expect(',}') == '}':
+            return result
+
+
+def load_json(chunks, decoder=None, depth=2):
+    '''Decode a whole JSON document from an iterable of strings.
+
+The outer 'depth' levels of arrays and objects are taken apart, so that
+only one of their members at a time has to be held as a string.'''
+    buf = _Buffer(chunks, decoder or _decoder)
+    result = _load(buf, depth)
+    if buf.skip():
+        raise ValueError('extra data at offset %d' % buf.pos)
+    return result
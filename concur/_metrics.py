@@ -0,0 +1,119 @@
+"""Latency statistics for ConcurClient.
+
+Samples are aggregated per endpoint template (see
+ConcurClient.endpoint_template) and per phase of a request:
+
+    server      sending the request until the response headers arrive,
+                including connecting when no pooled connection is free
+    download    reading the response body (XML is parsed as it is read,
+                so for XML this is counted as parse)
+    parse       XML or JSON parsing
+    convert     turning the parsed document into the internal form (XML
+                parsers that build it directly count it all as parse)
+    total       the whole call to ConcurClient.api, including retries
+
+Gauges hold the latest value of a named quantity, such as the limit set
+by an AdaptiveLimiter.
+"""
+
+from bisect import bisect_left
+from contextlib import contextmanager
+import threading
+import time
+
+
+class Histogram(object):
+    '''Counts of samples (in seconds) in exponentially sized buckets.'''
+
+    bounds = (0.001, 0.002, 0.005, 0.01, 0.02, 0.05, 0.1, 0.2, 0.5,
+              1.0, 2.0, 5.0, 10.0, 20.0, 60.0)
+
+    def __init__(self):
+        self.buckets = [0] * (len(self.bounds) + 1)
+        self.count = 0
+        self.total = 0.0
+        self.min = None
+        self.max = None
+
+    def add(self, value):
+        self.buckets[bisect_left(self.bounds, value)] += 1
+        self.count += 1
+        self.total += value
+        if self.min is None or value < self.min:
+            self.min = value
+        if self.max is None or value > self.max:
+            self.max = value
+
+    def percentile(self, p):
+        '''Return the upper bound of the bucket holding the p-th percentile.'''
+        if not self.count:
+            return None
+        rank = p / 100.0 * self.count
+        seen = 0
+        for bound, n in zip(self.bounds, self.buckets):
+            seen += n
+            if seen >= rank:
+                return min(bound, self.max)
+        return self.max
+
+    def snapshot(self):
+        return {
+            'count': self.count,
+            'total': self.total,
+            'mean': self.total / self.count if self.count else None,
+            'min': self.min,
+            'max': self.max,
+            'p50': self.percentile(50),
+            'p90': self.percentile(90),
+            'p99': self.percentile(99),
+            'buckets': zip(self.bounds + (None,), self.buckets),
+            }
+
+
+class Stats(object):
+    '''Thread-safe collection of histograms keyed by endpoint and phase.'''
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._histograms = {}
+        self._gauges = {}
+
+    def add(self, endpoint, phase, seconds):
+        with self._lock:
+            key = endpoint, phase
+            try:
+                histogram = self._histograms[key]
+            except KeyError:
+                histogram = self._histograms[key] = Histogram()
+            histogram.add(seconds)
+
+    @contextmanager
+    def timer(self, endpoint, phase):
+        '''Time the body of a with statement.'''
+        start = time.time()
+        try:
+            yield
+        finally:
+            self.add(endpoint, phase, time.time() - start)
+
+    def gauge(self, name, value):
+        with self._lock:
+            self._gauges[name] = value
+
+    def gauges(self):
+        '''Return {name: value} for all gauges.'''
+        with self._lock:
+            return dict(self._gauges)
+
+    def snapshot(self):
+        '''Return {endpoint: {phase: summary}} for all samples so far.'''
+        result = {}
+        with self._lock:
+            for (endpoint, phase), histogram in self._histograms.items():
+                result.setdefault(endpoint, {})[phase] = histogram.snapshot()
+        return result
+
+    def reset(self):
+        with self._lock:
+            self._histograms.clear()
+            self._gauges.clear()
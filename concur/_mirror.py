@@ -0,0 +1,209 @@
+"""A local SQLite mirror of expense reports and their entries.
+
+    mirror = ReportMirror(client, 'reports.db')
+    mirror.sync()                       # only fetches what has changed
+    mirror.reports(status='Approved')   # answered locally
+    mirror.entries(report_id)
+
+The first sync lists every report and fetches each one's details.  Later
+syncs list only the reports modified since shortly before the newest
+modification date seen so far, and fetch details only for those that are new or whose
+modification date or status changed, several at a time.
+"""
+
+import datetime
+import json
+import sqlite3
+import time
+import urlparse
+
+from _resilience import Deadline
+from _xml2json import as_list, unwrap
+
+
+def _earlier(timestamp, seconds):
+    '''Return an ISO 8601 timestamp moved back by 'seconds', or unchanged
+if it cannot be parsed.'''
+    try:
+        moment = datetime.datetime.strptime(timestamp[:19], '%Y-%m-%dT%H:%M:%S')
+    except ValueError:
+        return timestamp
+    return (moment - datetime.timedelta(seconds=seconds)).strftime(
+        '%Y-%m-%dT%H:%M:%S')
+
+
+class ReportMirror(object):
+    '''Keeps a SQLite database in step with a user's expense reports.'''
+
+    list_path = 'expense/expensereport/v2.0/Reports'
+    detail_path = 'expense/expensereport/v2.0/report/%s'
+    # The query parameter that restricts the list to recent changes.
+    modified_after_param = 'ModifiedDateAfter'
+    # The filter is strict, so the list is asked for from this many seconds
+    # before the newest modification seen; reports seen already are skipped.
+    overlap = 60
+    # The scheduler class of the mirror's requests.
+    priority = 'bulk'
+
+    schema = '''
+        CREATE TABLE IF NOT EXISTS reports (
+            id TEXT PRIMARY KEY,
+            name TEXT,
+            status TEXT,
+            currency TEXT,
+            total TEXT,
+            last_modified TEXT,
+            details TEXT,
+            synced REAL);
+        CREATE TABLE IF NOT EXISTS entries (
+            id TEXT PRIMARY KEY,
+            report_id TEXT,
+            expense_type TEXT,
+            transaction_date TEXT,
+            amount TEXT,
+            data TEXT);
+        CREATE INDEX IF NOT EXISTS entries_report_id ON entries (report_id);
+        CREATE TABLE IF NOT EXISTS sync_state (
+            name TEXT PRIMARY KEY,
+            value TEXT);
+        '''
+
+    def __init__(self, client, database, workers=8):
+        self.client = client
+        self.workers = workers
+        self.db = sqlite3.connect(database)
+        self.db.row_factory = sqlite3.Row
+        self.db.executescript(self.schema)
+
+    def close(self):
+        self.db.close()
+
+    def _state(self, name, value=None):
+        if value is None:
+            row = self.db.execute('SELECT value FROM sync_state WHERE name = ?',
+                                  (name,)).fetchone()
+            return row and row[0]
+        self.db.execute('INSERT OR REPLACE INTO sync_state VALUES (?, ?)',
+                        (name, value))
+
+    def list_reports(self, deadline=None, **params):
+        '''Yield the summaries of all reports, following NextPage links.
+
+'deadline' (a Deadline or a number of seconds) bounds all the pages
+together.'''
+        deadline = Deadline.coerce(deadline)
+        path = self.list_path
+        while path:
+            page = unwrap(self.client.get(path, _priority=self.priority,
+                                          _deadline=deadline, **params),
+                          'ReportsList')
+            for summary in as_list(page.get('ReportSummary')):
+                yield summary
+            path = page.get('NextPage')
+            if path:
+                url = urlparse.urlsplit(path)
+                path = url.path.split('/api/', 1)[-1]
+                params = dict(urlparse.parse_qsl(url.query))
+
+    def sync(self, full=False, deadline=None):
+        '''Bring the mirror up to date; returns a dictionary of counts.
+
+With 'full', every report is listed, and reports no longer listed are
+removed from the mirror.  'deadline' (a Deadline or a number of seconds)
+bounds the listing and fetching together; if it passes or is cancelled
+while listing, ConcurDeadlineError is raised and nothing is changed, and
+reports not fetched by then are counted as failed.'''
+        deadline = Deadline.coerce(deadline)
+        since = None if full else self._state('last_modified')
+        params = ({self.modified_after_param: _earlier(since, self.overlap)}
+                  if since else {})
+        # Missing values are stored as NULL and compared as ''.
+        known = dict((row['id'], (row['last_modified'] or '',
+                                  row['status'] or ''))
+                     for row in self.db.execute(
+                         'SELECT id, last_modified, status FROM reports'))
+        listed = set()
+        changed = []
+        newest = since or ''
+        for summary in self.list_reports(deadline, **params):
+            report_id = summary['ReportID']
+            if report_id in listed:
+                continue
+            modified = summary.get('LastModifiedDate') or ''
+            listed.add(report_id)
+            newest = max(newest, modified)
+            if known.get(report_id) != (modified,
+                                        summary.get('ApprovalStatusName') or ''):
+                changed.append(summary)
+
+        details = self.client.get_many(
+            [self.detail_path % summary['ReportID'] for summary in changed],
+            workers=self.workers, errors='return', priority=self.priority,
+            deadline=deadline)
+        failed = 0
+        now = time.time()
+        with self.db:
+            for summary, detail in zip(changed, details):
+                if isinstance(detail, Exception):
+                    failed += 1
+                    continue
+                self._store(summary, unwrap(detail, 'ReportDetails'), now)
+            removed = 0
+            if full:
+                for report_id in set(known) - listed:
+                    self._delete(report_id)
+                    removed += 1
+            if not failed and newest:
+                self._state('last_modified', newest)
+        return {'listed': len(listed), 'fetched': len(changed) - failed,
+                'failed': failed, 'removed': removed}
+
+    def _store(self, summary, detail, now):
+        report_id = summary['ReportID']
+        self.db.execute(
+            'INSERT OR REPLACE INTO reports VALUES (?, ?, ?, ?, ?, ?, ?, ?)',
+            (report_id, summary.get('ReportName'),
+             summary.get('ApprovalStatusName'), summary.get('ReportCurrency'),
+             summary.get('ReportTotal'), summary.get('LastModifiedDate'),
+             json.dumps(detail), now))
+        self.db.execute('DELETE FROM entries WHERE report_id = ?', (report_id,))
+        entries = as_list((detail.get('ExpenseEntriesList') or {}).get('ExpenseEntry'))
+        self.db.executemany(
+            'INSERT OR REPLACE INTO entries VALUES (?, ?, ?, ?, ?, ?)',
+            [(entry.get('ReportEntryID'), report_id, entry.get('ExpenseTypeName'),
+              entry.get('TransactionDate'), entry.get('TransactionAmount'),
+              json.dumps(entry)) for entry in entries])
+
+    def _delete(self, report_id):
+        self.db.execute('DELETE FROM entries WHERE report_id = ?', (report_id,))
+        self.db.execute('DELETE FROM reports WHERE id = ?', (report_id,))
+
+    # Local queries.
+
+    def reports(self, status=None, modified_since=None):
+        '''Return summaries of the mirrored reports, newest first.'''
+        query = 'SELECT id, name, status, currency, total, last_modified FROM reports'
+        conditions, args = [], []
+        if status is not None:
+            conditions.append('status = ?')
+            args.append(status)
+        if modified_since is not None:
+            conditions.append('last_modified > ?')
+            args.append(modified_since)
+        if conditions:
+            query += ' WHERE ' + ' AND '.join(conditions)
+        query += ' ORDER BY last_modified DESC'
+        return [dict(row) for row in self.db.execute(query, args)]
+
+    def report(self, report_id):
+        '''Return a report's details as last fetched.'''
+        row = self.db.execute('SELECT details FROM reports WHERE id = ?',
+                              (report_id,)).fetchone()
+        if row is None:
+            raise KeyError(report_id)
+        return json.loads(row[0])
+
+    def entries(self, report_id):
+        '''Return a report's entries.'''
+        return [json.loads(row[0]) for row in self.db.execute(
+            'SELECT data FROM entries WHERE report_id = ?', (report_id,))]
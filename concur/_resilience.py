@@ -0,0 +1,475 @@
+"""Circuit breakers and bounded queues for ConcurClient.
+
+Both are kept per endpoint template (see ConcurClient.endpoint_template),
+so that an endpoint in trouble does not tie up the threads calling the
+healthy ones:
+
+    CircuitBreaker  after 'threshold' consecutive failures (connection
+                    errors or a status in ConcurClient.retry_statuses) the
+                    circuit opens and requests fail at once; after
+                    'reset_timeout' seconds a limited number of probe
+                    requests are let through, and the circuit closes again
+                    on the first success or reopens on a failure
+    Bulkhead        at most 'limit' requests at a time; up to 'queue' more
+                    wait for a slot, and any beyond that are shed
+
+AdaptiveLimiter is shared by all endpoints instead, and tunes how many
+requests a client has in flight to what Concur will take at the moment;
+PriorityScheduler divides the requests in flight between classes of
+traffic, such as interactive lookups and bulk syncs.  A Deadline bounds
+the time a call, or a batch of calls, may take in all, and can be
+cancelled.
+"""
+
+from collections import deque
+from contextlib import contextmanager
+import threading
+import time
+import weakref
+
+CLOSED, OPEN, HALF_OPEN = 'closed', 'open', 'half-open'
+
+
+def _until(timeout, deadline):
+    '''Return the time by which a wait bounded by 'timeout' seconds and by
+'deadline' (either may be None) must end, or None if it need not.'''
+    ends = time.time() + timeout if timeout is not None else None
+    if deadline is not None and deadline.expires is not None:
+        ends = deadline.expires if ends is None else min(ends, deadline.expires)
+    return ends
+
+
+@contextmanager
+def _waking(deadline, cond):
+    '''While the block runs, have 'deadline' (if any) wake the threads
+waiting on 'cond' when it is cancelled.'''
+    if deadline is None:
+        yield
+        return
+    with deadline._lock:
+        deadline._conditions.append(cond)
+    try:
+        yield
+    finally:
+        with deadline._lock:
+            deadline._conditions.remove(cond)
+
+
+class CircuitBreaker(object):
+    '''Tracks the health of one endpoint.'''
+
+    def __init__(self, threshold=5, reset_timeout=30.0, probes=1):
+        self.threshold = threshold
+        self.reset_timeout = reset_timeout
+        self.probes = probes
+        self._lock = threading.Lock()
+        self._state = CLOSED
+        self._failures = 0
+        self._opened = None
+        self._probing = 0
+
+    @property
+    def state(self):
+        with self._lock:
+            self._expire()
+            return self._state
+
+    def _expire(self):
+        if (self._state == OPEN and
+                time.time() - self._opened >= self.reset_timeout):
+            self._state = HALF_OPEN
+            self._probing = 0
+
+    def allow(self):
+        '''Return true if a request may be sent now.
+
+Every allowed request must be followed by a call to record().'''
+        with self._lock:
+            self._expire()
+            if self._state == CLOSED:
+                return True
+            if self._state == HALF_OPEN and self._probing < self.probes:
+                self._probing += 1
+                return True
+            return False
+
+    def retry_in(self):
+        '''Return the seconds until the circuit will let a probe through.'''
+        with self._lock:
+            if self._state != OPEN:
+                return 0.0
+            return max(0.0, self._opened + self.reset_timeout - time.time())
+
+    def record(self, ok):
+        '''Record the outcome of an allowed request; None if it was given up
+before there was one.'''
+        with self._lock:
+            if ok is None:
+                if self._state == HALF_OPEN:
+                    self._probing -= 1
+            elif self._state == HALF_OPEN:
+                self._probing -= 1
+                if ok:
+                    self._state = CLOSED
+                    self._failures = 0
+                else:
+                    self._open()
+            elif ok:
+                self._failures = 0
+            else:
+                self._failures += 1
+                if self._state == CLOSED and self._failures >= self.threshold:
+                    self._open()
+
+    def _open(self):
+        self._state = OPEN
+        self._opened = time.time()
+        self._failures = 0
+
+    def snapshot(self):
+        with self._lock:
+            self._expire()
+            return {'state': self._state, 'failures': self._failures}
+
+
+class Bulkhead(object):
+    '''Limits the requests in flight to one endpoint, queueing a few more.'''
+
+    def __init__(self, limit, queue=0, timeout=None):
+        self.limit = limit
+        self.queue = queue
+        self.timeout = timeout
+        self._cond = threading.Condition()
+        self.active = 0
+        self.waiting = 0
+        self.shed = 0
+
+    def acquire(self, timeout=None, deadline=None):
+        '''Take a slot, waiting in the queue if need be.
+
+Returns false, without taking a slot, if the queue is full, the wait
+timed out or 'deadline' (a Deadline) passed or was cancelled.  'timeout',
+if given, shortens the wait.'''
+        if self.timeout is not None:
+            timeout = (self.timeout if timeout is None
+                       else min(timeout, self.timeout))
+        with self._cond:
+            if deadline is not None and deadline.done:
+                return False
+            if self.active < self.limit:
+                self.active += 1
+                return True
+            if self.waiting >= self.queue:
+                self.shed += 1
+                return False
+            until = _until(timeout, deadline)
+            self.waiting += 1
+            try:
+                with _waking(deadline, self._cond):
+                    while self.active >= self.limit:
+                        if deadline is not None and deadline.cancelled:
+                            # Pass on a release this thread may have taken.
+                            self._cond.notify()
+                            return False
+                        if until is None:
+                            self._cond.wait()
+                        else:
+                            remaining = until - time.time()
+                            if remaining <= 0:
+                                self.shed += 1
+                                self._cond.notify()
+                                return False
+                            self._cond.wait(remaining)
+            finally:
+                self.waiting -= 1
+            self.active += 1
+            return True
+
+    def release(self):
+        with self._cond:
+            self.active -= 1
+            self._cond.notify()
+
+    def snapshot(self):
+        with self._cond:
+            return {'active': self.active, 'waiting': self.waiting,
+                    'shed': self.shed}
+
+
+class AdaptiveLimiter(object):
+    '''Limits the requests in flight, adjusting the limit as it goes.
+
+The limit grows by about one for each limit's worth of requests that
+succeed promptly (additive increase), and is multiplied by 'backoff'
+when a request is throttled or fails, or when an endpoint's latency
+rises above 'tolerance' times the lowest seen for that endpoint
+(multiplicative decrease), at most once per smoothed round trip.  Each
+endpoint is compared with itself, so slow endpoints are not mistaken for
+congestion next to fast ones.  'stats', if given, receives the limit and
+the number in flight as gauges.'''
+
+    def __init__(self, initial=4, minimum=1, maximum=64, backoff=0.7,
+                 tolerance=2.0, stats=None):
+        self.limit = float(initial)
+        self.minimum = minimum
+        self.maximum = maximum
+        self.backoff = backoff
+        self.tolerance = tolerance
+        self.stats = stats
+        self.in_flight = 0
+        # The lowest and the smoothed latency of each endpoint.
+        self.latencies = {}
+        self._decreased = 0.0
+        self._cond = threading.Condition()
+
+    def acquire(self, timeout=None, deadline=None):
+        '''Wait for room under the limit; return False on timeout, or if
+'deadline' (a Deadline) passes or is cancelled.'''
+        until = _until(timeout, deadline)
+        with self._cond, _waking(deadline, self._cond):
+            while True:
+                if deadline is not None and deadline.cancelled:
+                    return False
+                if self.in_flight < int(self.limit):
+                    break
+                if until is None:
+                    self._cond.wait()
+                else:
+                    remaining = until - time.time()
+                    if remaining <= 0:
+                        return False
+                    self._cond.wait(remaining)
+            self.in_flight += 1
+            self._report()
+            return True
+
+    def release(self, ok, latency=None, endpoint=None):
+        '''Record the outcome of a request to 'endpoint' and free its place.
+
+'ok' is false for throttling and server or connection errors, and None
+for a request given up before it had an outcome.'''
+        with self._cond:
+            self.in_flight -= 1
+            now = time.time()
+            if ok is None:
+                self._cond.notify_all()
+                return
+            smoothed = self.latencies.get(endpoint)
+            if latency is not None and ok:
+                if smoothed is None:
+                    lowest = smoothed = latency
+                else:
+                    # The floor creeps up, so that a lasting change in
+                    # latency stops counting as congestion.
+                    lowest, smoothed = smoothed
+                    lowest = min(latency, lowest * 1.001)
+                    smoothed = 0.9 * smoothed + 0.1 * latency
+                self.latencies[endpoint] = lowest, smoothed
+                congested = smoothed > self.tolerance * max(lowest, 0.001)
+            else:
+                smoothed = smoothed and smoothed[1]
+                congested = False
+            if not ok or congested:
+                if now - self._decreased >= (smoothed or 0.0):
+                    self.limit = max(self.minimum, self.limit * self.backoff)
+                    self._decreased = now
+            else:
+                self.limit = min(self.maximum, self.limit + 1.0 / self.limit)
+            self._report()
+            self._cond.notify_all()
+
+    def _report(self):
+        if self.stats is not None:
+            self.stats.gauge('concurrency_limit', int(self.limit))
+            self.stats.gauge('in_flight', self.in_flight)
+
+    def snapshot(self):
+        with self._cond:
+            return {'limit': int(self.limit), 'in_flight': self.in_flight,
+                    'latencies': dict(self.latencies)}
+
+
+class PriorityScheduler(object):
+    '''Shares a number of request slots between classes of traffic.
+
+When a slot comes free and several classes are waiting, it goes to the
+class furthest behind its share, so with the default shares interactive
+requests get four slots for every one given to bulk work, but bulk work
+is never starved.  Within a class, requests go in order.  'capacity' is
+a number, or a function returning one (such as lambda: int(limiter.limit)
+to follow an AdaptiveLimiter).  'limits' optionally caps the slots a
+class may hold at once.'''
+
+    def __init__(self, capacity=8, shares=None, limits=None):
+        self.capacity = capacity
+        self.shares = shares or {'interactive': 4, 'bulk': 1}
+        self.limits = limits or {}
+        self._cond = threading.Condition()
+        self._queues = dict((name, deque()) for name in self.shares)
+        self._active = dict.fromkeys(self.shares, 0)
+        self._served = dict.fromkeys(self.shares, 0)
+        self._vtime = dict.fromkeys(self.shares, 0.0)
+        self._now = 0.0
+
+    def _capacity(self):
+        return self.capacity() if callable(self.capacity) else self.capacity
+
+    def _next(self):
+        '''Return the class whose first waiter should go next, if any.'''
+        if sum(self._active.values()) >= self._capacity():
+            return None
+        ready = [name for name, queue in self._queues.items()
+                 if queue and (self.limits.get(name) is None or
+                               self._active[name] < self.limits[name])]
+        if not ready:
+            return None
+        return min(ready, key=self._vtime.get)
+
+    def acquire(self, priority, timeout=None, deadline=None):
+        '''Wait for a slot for a request of class 'priority'; return False
+on timeout, or if 'deadline' (a Deadline) passes or is cancelled.'''
+        if priority not in self.shares:
+            raise ValueError('unknown priority: %r' % priority)
+        ticket = object()
+        until = _until(timeout, deadline)
+        with self._cond, _waking(deadline, self._cond):
+            queue = self._queues[priority]
+            if not queue:
+                # A class that was idle starts level with the others.
+                self._vtime[priority] = max(self._vtime[priority], self._now)
+            queue.append(ticket)
+            while True:
+                if deadline is not None and deadline.cancelled:
+                    remaining = 0
+                else:
+                    name = self._next()
+                    if name is not None and self._queues[name][0] is ticket:
+                        break
+                    remaining = None if until is None else until - time.time()
+                if remaining is None:
+                    self._cond.wait()
+                elif remaining <= 0:
+                    queue.remove(ticket)
+                    self._cond.notify_all()
+                    return False
+                else:
+                    self._cond.wait(remaining)
+            queue.popleft()
+            self._active[priority] += 1
+            self._served[priority] += 1
+            self._now = self._vtime[priority]
+            self._vtime[priority] += 1.0 / self.shares[priority]
+            self._cond.notify_all()
+            return True
+
+    def release(self, priority):
+        with self._cond:
+            self._active[priority] -= 1
+            self._cond.notify_all()
+
+    def snapshot(self):
+        with self._cond:
+            return dict((name, {'waiting': len(self._queues[name]),
+                                'active': self._active[name],
+                                'served': self._served[name]})
+                        for name in self.shares)
+
+
+class Deadline(object):
+    '''A time limit for a call or a batch of calls, which may be cancelled.
+
+'timeout' is in seconds, or None for no limit.  cancel() may be called
+from any thread; calls using the deadline give up before their next
+request, retry or chunk of a response, and the responses they have open
+are closed, so that their connections are not reused.  Calls waiting
+for a slot (see Bulkhead, AdaptiveLimiter and PriorityScheduler) are woken
+and give up too.'''
+
+    # How often wait_for() checks for a cancellation.
+    poll_interval = 0.05
+
+    def __init__(self, timeout=None):
+        self.expires = time.time() + timeout if timeout is not None else None
+        self._cancelled = threading.Event()
+        self._lock = threading.Lock()
+        self._responses = weakref.WeakSet()
+        # The conditions that threads using the deadline are waiting on.
+        self._conditions = []
+
+    @classmethod
+    def coerce(cls, value):
+        '''Return 'value' if it is a Deadline or None, or else a Deadline
+'value' seconds away.'''
+        if value is None or isinstance(value, Deadline):
+            return value
+        return cls(value)
+
+    def within(self, timeout):
+        '''Return a deadline 'timeout' seconds away, or this one if that is
+sooner.  The two are cancelled together.'''
+        child = Deadline(timeout)
+        if self.expires is not None:
+            child.expires = min(child.expires, self.expires)
+        child._cancelled = self._cancelled
+        child._lock = self._lock
+        child._responses = self._responses
+        child._conditions = self._conditions
+        return child
+
+    @property
+    def cancelled(self):
+        return self._cancelled.is_set()
+
+    @property
+    def expired(self):
+        return self.expires is not None and time.time() >= self.expires
+
+    @property
+    def done(self):
+        return self.cancelled or self.expired
+
+    def remaining(self):
+        '''Return the seconds left, or None if there is no limit.'''
+        if self.expires is None:
+            return None
+        return max(0.0, self.expires - time.time())
+
+    def wait(self, seconds):
+        '''Sleep for 'seconds', or until the deadline is cancelled or passes;
+return true if there is still time.'''
+        remaining = self.remaining()
+        if remaining is not None:
+            seconds = min(seconds, remaining)
+        self._cancelled.wait(seconds)
+        return not self.done
+
+    def wait_for(self, event):
+        '''Wait until 'event' (a threading.Event) is set, or the deadline is
+cancelled or passes; return true if the event was set.'''
+        while not event.is_set():
+            if self.done:
+                return False
+            remaining = self.remaining()
+            event.wait(self.poll_interval if remaining is None
+                       else min(self.poll_interval, remaining))
+        return True
+
+    def track(self, response):
+        '''Close 'response' if the deadline is cancelled while it is open.'''
+        with self._lock:
+            if not self.cancelled:
+                self._responses.add(response)
+                return
+        response.close()
+
+    def cancel(self):
+        with self._lock:
+            self._cancelled.set()
+            responses = list(self._responses)
+            self._responses.clear()
+            conditions = list(self._conditions)
+        for response in responses:
+            response.close()
+        for cond in conditions:
+            with cond:
+                cond.notify_all()
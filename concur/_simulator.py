@@ -0,0 +1,414 @@
+#!/usr/bin/env python
+
+"""A local stand-in for the Concur API, for load and latency testing.
+
+The simulator serves generated expense reports, entries, extract jobs,
+images, quick expenses and OAuth tokens over HTTP, as XML or (when the
+Accept header asks for it first) JSON.  Latency, injected errors,
+throttling and page size are all configurable:
+
+    with ConcurSimulator(reports=1000, latency=0.05, error_rate=0.01) as sim:
+        client = ConcurClient(access_token='anything')
+        sim.configure(client)
+        client.get('expense/expensereport/v2.0/Reports')
+        print sim.counts
+
+It can also be run from the command line; see main().
+"""
+
+import BaseHTTPServer
+from collections import Counter
+import json
+import optparse
+import random
+import re
+import SocketServer
+import threading
+import time
+import urllib
+import urlparse
+import zlib
+
+import xml.etree.cElementTree as ET
+
+from _xml2json import internal_to_elem, UsingPrefix
+
+REPORT_NS = 'http://www.concursolutions.com/api/expense/expensereport/2011/03'
+EXTRACT_NS = 'http://www.concursolutions.com/api/expense/extract/2010/02'
+IMAGE_NS = 'http://www.concursolutions.com/api/image/2011/02'
+
+
+def _id(kind, n):
+    '''Make an ID shaped like Concur's.'''
+    return '%s$s%022d' % (kind, n)
+
+
+class _Server(SocketServer.ThreadingMixIn, BaseHTTPServer.HTTPServer):
+    daemon_threads = True
+    allow_reuse_address = True
+
+
+class ConcurSimulator(object):
+    '''Serves a synthetic Concur tenant on a local port.
+
+'latency' seconds (plus up to 'jitter' more) are added to every request.
+A fraction 'error_rate' of requests fail with a status picked from
+'error_statuses'.  If 'rate_limit' is set, requests beyond that many per
+second (with bursts of up to 'burst') are answered with 429.  Responses of
+'compress_min_size' bytes or more are gzipped for clients that accept it,
+and gzipped request bodies are answered with 415 unless 'gzip_requests'.'''
+
+    def __init__(self, reports=100, entries=3, latency=0.0, jitter=0.0,
+                 error_rate=0.0, error_statuses=(429, 500, 503),
+                 rate_limit=None, burst=10, page_size=100,
+                 compress_min_size=1024, gzip_requests=True,
+                 host='127.0.0.1', port=0, seed=0):
+        self.latency = latency
+        self.jitter = jitter
+        self.error_rate = error_rate
+        self.error_statuses = error_statuses
+        self.rate_limit = rate_limit
+        self.burst = burst
+        self.page_size = page_size
+        self.compress_min_size = compress_min_size
+        self.gzip_requests = gzip_requests
+        self.random = random.Random(seed)
+        self.counts = Counter()
+        self._lock = threading.Lock()
+        self._tokens = burst
+        self._last = time.time()
+        self._jobs = {}
+        self.reports = [self.make_report(i, entries) for i in range(reports)]
+        self.report_index = dict((r['ReportID'], r) for r in self.reports)
+        self.server = _Server((host, port), self._handler())
+        self.thread = None
+
+    @property
+    def url(self):
+        return 'http://%s:%d' % self.server.server_address
+
+    def configure(self, client):
+        '''Point a ConcurClient at the simulator.'''
+        client.api_url = self.url + '/api'
+        client.token_url = self.url + '/net2/oauth2/GetAccessToken.ashx'
+        return client
+
+    def start(self):
+        self.thread = threading.Thread(target=self.server.serve_forever)
+        self.thread.daemon = True
+        self.thread.start()
+        return self
+
+    def stop(self):
+        self.server.shutdown()
+        self.server.server_close()
+
+    def __enter__(self):
+        return self.start()
+
+    def __exit__(self, *exc_info):
+        self.stop()
+
+    # Synthetic data.
+
+    def make_report(self, i, entries):
+        report_id = _id('RPT', i)
+        day = i % 28 + 1
+        report = {
+            'ReportID': report_id,
+            'ReportName': 'Expenses for client visit %d' % i,
+            'ReportCurrency': 'USD',
+            'ApprovalStatusName': self.random.choice(
+                ['Not Submitted', 'Submitted', 'Approved']),
+            'PaymentStatusName': 'Not Paid',
+            'ReportDate': '2013-06-%02dT00:00:00' % day,
+            'LastModifiedDate': '2013-06-%02dT10:%02d:00' % (day, i % 60),
+            'entries': [],
+            'attendees': {},
+            }
+        total = 0
+        for j in range(entries):
+            amount = round(self.random.uniform(5, 500), 2)
+            total += amount
+            report['entries'].append({
+                'ReportEntryID': _id('ENT', i * 1000 + j),
+                'ExpenseTypeName': self.random.choice(
+                    ['Airfare', 'Hotel', 'Meals', 'Taxi']),
+                'TransactionDate': report['ReportDate'],
+                'TransactionAmount': '%.2f' % amount,
+                'TransactionCurrencyName': 'US, Dollar',
+                'VendorDescription': 'Vendor %d' % j,
+                })
+            report['attendees'][_id('ENT', i * 1000 + j)] = [{
+                'AttendeeID': _id('ATT', (i * 1000 + j) * 10 + k),
+                'AttendeeTypeCode': self.random.choice(self.attendee_types),
+                'FirstName': 'Guest',
+                'LastName': str(k),
+                } for k in range(self.random.randint(0, 2))]
+        report['ReportTotal'] = '%.2f' % total
+        return report
+
+    def touch(self, report, status=None):
+        '''Mark a report (or its index) as modified now.'''
+        if not isinstance(report, dict):
+            report = self.reports[report]
+        report['LastModifiedDate'] = time.strftime('%Y-%m-%dT%H:%M:%S')
+        if status:
+            report['ApprovalStatusName'] = status
+        return report
+
+    attendee_types = ['BUSGUEST', 'EMPLOYEE', 'SPOUSE']
+
+    def summary(self, report):
+        summary = dict((k, v) for k, v in report.items()
+                       if k not in ('entries', 'attendees'))
+        summary['ReportDetailsURL'] = '%s/api/expense/expensereport/v2.0/report/%s' % (
+            self.url, report['ReportID'])
+        return summary
+
+    # Endpoints; each returns (status, root tag, namespace, body).
+
+    def get_reports(self, params):
+        offset = int(params.get('Offset', 0))
+        limit = int(params.get('Limit', self.page_size))
+        reports = self.reports
+        since = params.get('ModifiedDateAfter')
+        if since:
+            reports = [r for r in reports if r['LastModifiedDate'] > since]
+        page = reports[offset:offset + limit]
+        body = {'ReportSummary': [self.summary(r) for r in page]}
+        if offset + limit < len(reports):
+            body['NextPage'] = '%s/api/expense/expensereport/v2.0/Reports?%s' % (
+                self.url, urllib.urlencode(dict(params, Offset=offset + limit,
+                                                Limit=limit)))
+        return 200, 'ReportsList', REPORT_NS, body
+
+    def get_report(self, params, report_id):
+        report = self.report_index.get(report_id)
+        if report is None:
+            return 404, 'Error', None, {'Message': 'Report not found'}
+        body = self.summary(report)
+        body['ExpenseEntriesList'] = {'ExpenseEntry': report['entries']}
+        return 200, 'ReportDetails', REPORT_NS, body
+
+    def get_entry(self, params, report_id, entry_id):
+        report = self.report_index.get(report_id)
+        for entry in report['entries'] if report else []:
+            if entry['ReportEntryID'] == entry_id:
+                break
+        else:
+            return 404, 'Error', None, {'Message': 'Entry not found'}
+        body = dict(entry)
+        body['ItemizationsList'] = {'Itemization': [{
+            'ItemizationID': entry_id.replace('ENT', 'ITM'),
+            'ExpenseTypeName': entry['ExpenseTypeName'],
+            'TransactionAmount': entry['TransactionAmount'],
+            }]}
+        return 200, 'ReportEntryDetails', REPORT_NS, body
+
+    def get_attendees(self, params, report_id, entry_id):
+        report = self.report_index.get(report_id)
+        if report is None or entry_id not in report['attendees']:
+            return 404, 'Error', None, {'Message': 'Entry not found'}
+        return 200, 'AttendeesList', REPORT_NS, {
+            'Attendee': report['attendees'][entry_id]}
+
+    def get_attendee_type(self, params, code):
+        if code not in self.attendee_types:
+            return 404, 'Error', None, {'Message': 'Attendee type not found'}
+        return 200, 'AttendeeType', None, {
+            'Code': code, 'Name': code.title(), 'ConnectorID': None}
+
+    def get_extracts(self, params):
+        return 200, 'definitions', EXTRACT_NS, {'definition': [
+            {'id': 'EXT$%d' % i, 'job-link': '%s/api/expense/extract/v1.0/EXT$%d/job' % (self.url, i)}
+            for i in range(3)]}
+
+    def post_job(self, params, extract_id):
+        with self._lock:
+            job_id = 'JOB$%d' % (len(self._jobs) + 1)
+            self._jobs[job_id] = time.time()
+        return 200, 'job', EXTRACT_NS, {
+            'id': job_id, 'status': 'In Queue',
+            'status-link': '%s/api/expense/extract/v1.0/%s/job/%s/status' % (
+                self.url, extract_id, job_id)}
+
+    def get_job_status(self, params, extract_id, job_id):
+        started = self._jobs.get(job_id)
+        if started is None:
+            return 404, 'Error', None, {'Message': 'Job not found'}
+        done = time.time() - started > 1
+        body = {'id': job_id, 'status': 'Completed' if done else 'In Process'}
+        if done:
+            body['file-link'] = '%s/api/expense/extract/v1.0/%s/job/%s/file' % (
+                self.url, extract_id, job_id)
+        return 200, 'job', EXTRACT_NS, body
+
+    def get_job_file(self, params, extract_id, job_id):
+        lines = ['%s|%s|%s' % (r['ReportID'], r['ReportName'], r['ReportTotal'])
+                 for r in self.reports]
+        return 200, None, None, '\n'.join(lines) + '\n'
+
+    def get_image(self, params, kind, image_id):
+        return 200, 'Image', IMAGE_NS, {
+            'Id': image_id,
+            'Url': '%s/images/%s/%s.pdf' % (self.url, kind, image_id)}
+
+    def quickexpense(self, params, *args):
+        return 200, 'QuickExpense', REPORT_NS, {
+            'QuickExpenseKey': _id('QE', self.random.randint(0, 10 ** 6)),
+            'Status': 'SUCCESS'}
+
+    def get_token(self, params):
+        return 200, 'Access_Token', None, {
+            'Token': 'SIMULATED' + _id('TOK', self.random.randint(0, 10 ** 6)),
+            'Expiration_date': '12/31/2099 12:00:00 AM',
+            'Refresh_Token': _id('REF', 0)}
+
+    routes = [
+        ('GET', r'/api/expense/expensereport/v2\.0/Reports', 'get_reports'),
+        ('GET', r'/api/expense/expensereport/v2\.0/report/([^/]+)', 'get_report'),
+        ('GET', r'/api/expense/expensereport/v1\.1/report/([^/]+)/entry/([^/]+)', 'get_entry'),
+        ('GET', r'/api/expense/expensereport/v2\.0/report/([^/]+)/entry/([^/]+)/Attendees', 'get_attendees'),
+        ('GET', r'/api/v3\.0/expense/attendeetypes/([^/]+)', 'get_attendee_type'),
+        ('GET', r'/api/expense/extract/v1\.0', 'get_extracts'),
+        ('POST', r'/api/expense/extract/v1\.0/([^/]+)/job', 'post_job'),
+        ('GET', r'/api/expense/extract/v1\.0/([^/]+)/job/([^/]+)(?:/status)?', 'get_job_status'),
+        ('GET', r'/api/expense/extract/v1\.0/([^/]+)/job/([^/]+)/file', 'get_job_file'),
+        ('GET', r'/api/image/v1\.[01]/(report|expenseentry|invoice|receipt)/([^/]+)', 'get_image'),
+        ('GET', r'/api/expense/expensereport/v1\.0/quickexpense/?', 'quickexpense'),
+        ('POST', r'/api/expense/expensereport/v1\.0/quickexpense/?', 'quickexpense'),
+        ('GET', r'/net2/oauth2/GetAccessToken\.ashx', 'get_token'),
+        ]
+    routes = [(method, re.compile(pattern + '$'), name)
+              for method, pattern, name in routes]
+
+    # Request handling.
+
+    def throttled(self):
+        '''Take a token from the bucket; return True if there was none.'''
+        if self.rate_limit is None:
+            return False
+        with self._lock:
+            now = time.time()
+            self._tokens = min(self.burst,
+                               self._tokens + (now - self._last) * self.rate_limit)
+            self._last = now
+            if self._tokens < 1:
+                return True
+            self._tokens -= 1
+            return False
+
+    def respond(self, method, path, query, headers):
+        '''Return (status, headers, body) for a request.'''
+        time.sleep(self.latency + self.random.uniform(0, self.jitter))
+        want_json = 'json' in headers.get('Accept', '').split(',')[0]
+        extra = {}
+        if not path.startswith('/net2/') and 'Authorization' not in headers:
+            status, tag, ns, body = 401, 'Error', None, {'Message': 'Unauthorized'}
+        elif (headers.get('Content-Encoding') == 'gzip' and
+                not self.gzip_requests):
+            status, tag, ns, body = 415, 'Error', None, {'Message': 'Unsupported encoding'}
+        elif self.throttled():
+            status, tag, ns, body = 429, 'Error', None, {'Message': 'Too many requests'}
+            extra['Retry-After'] = '1'
+        elif self.error_rate and self.random.random() < self.error_rate:
+            status = self.random.choice(self.error_statuses)
+            tag, ns, body = 'Error', None, {'Message': 'Injected error'}
+            if status == 429:
+                extra['Retry-After'] = '1'
+        else:
+            params = dict(urlparse.parse_qsl(query))
+            for route_method, pattern, name in self.routes:
+                match = pattern.match(path)
+                if match and route_method == method:
+                    status, tag, ns, body = getattr(self, name)(params, *match.groups())
+                    break
+            else:
+                status, tag, ns, body = 404, 'Error', None, {'Message': 'No such endpoint'}
+        with self._lock:
+            self.counts[status] += 1
+            self.counts[method, path] += 1
+        if tag is None:
+            extra['Content-Type'] = 'text/plain'
+        elif want_json:
+            extra['Content-Type'] = 'application/json'
+            body = json.dumps(body)
+        else:
+            extra['Content-Type'] = 'application/xml'
+            elem = internal_to_elem({tag: body},
+                                    canonize=UsingPrefix(default_namespace=ns))
+            body = ET.tostring(elem, 'utf-8')
+        if (self.compress_min_size is not None and
+                len(body) >= self.compress_min_size and
+                'gzip' in headers.get('Accept-Encoding', '')):
+            compressor = zlib.compressobj(6, zlib.DEFLATED, 16 + zlib.MAX_WBITS)
+            body = compressor.compress(body) + compressor.flush()
+            extra['Content-Encoding'] = 'gzip'
+        return status, extra, body
+
+    def _handler(self):
+        simulator = self
+
+        class Handler(BaseHTTPServer.BaseHTTPRequestHandler):
+            protocol_version = 'HTTP/1.1'
+
+            def log_message(self, *args):
+                pass
+
+            def handle_one(self):
+                path, _, query = self.path.partition('?')
+                length = int(self.headers.get('Content-Length') or 0)
+                if length:
+                    data = self.rfile.read(length)
+                    if (self.headers.get('Content-Encoding') == 'gzip' and
+                            simulator.gzip_requests):
+                        zlib.decompress(data, 16 + zlib.MAX_WBITS)
+                status, headers, body = simulator.respond(
+                    self.command, path, query, self.headers)
+                self.send_response(status)
+                for item in headers.items():
+                    self.send_header(*item)
+                self.send_header('Content-Length', str(len(body)))
+                self.end_headers()
+                self.wfile.write(body)
+
+            do_GET = do_POST = do_PUT = do_DELETE = handle_one
+
+        return Handler
+
+
+def main():
+    p = optparse.OptionParser(
+        description='Serves a simulated Concur API for load testing',
+        prog='concur_simulator',
+        usage='%prog [options]'
+    )
+    p.add_option('--port', '-p', type='int', default=8080)
+    p.add_option('--reports', type='int', default=100)
+    p.add_option('--entries', type='int', default=3,
+                 help='entries per report')
+    p.add_option('--latency', type='float', default=0.0,
+                 help='seconds added to each request')
+    p.add_option('--jitter', type='float', default=0.0,
+                 help='up to this many more seconds, at random')
+    p.add_option('--error-rate', type='float', default=0.0,
+                 help='fraction of requests that fail with 429 or 5xx')
+    p.add_option('--rate-limit', type='float',
+                 help='requests per second before throttling with 429')
+    p.add_option('--page-size', type='int', default=100)
+    options, arguments = p.parse_args()
+
+    simulator = ConcurSimulator(
+        reports=options.reports, entries=options.entries,
+        latency=options.latency, jitter=options.jitter,
+        error_rate=options.error_rate, rate_limit=options.rate_limit,
+        page_size=options.page_size, port=options.port)
+    print 'Serving on %s/api' % simulator.url
+    try:
+        simulator.server.serve_forever()
+    except KeyboardInterrupt:
+        pass
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,109 @@
+"""Buffering of response bodies within a memory budget.
+
+A body is held in memory while it is smaller than a threshold and the
+client's MemoryBudget has room for it; otherwise it is written to an
+anonymous temporary file and read back from there, a chunk at a time.
+"""
+
+import tempfile
+import threading
+
+
+class MemoryBudget(object):
+    '''The bytes of response bodies a client may hold in memory at once.
+
+A limit of None is unlimited.'''
+
+    def __init__(self, limit=None):
+        self.limit = limit
+        self.used = 0
+        self.peak = 0
+        self._lock = threading.Lock()
+
+    def reserve(self, n):
+        '''Take n bytes of the budget; return False if there is no room.'''
+        with self._lock:
+            if self.limit is not None and self.used + n > self.limit:
+                return False
+            self.used += n
+            self.peak = max(self.peak, self.used)
+            return True
+
+    def release(self, n):
+        with self._lock:
+            self.used -= n
+
+
+class Spool(object):
+    '''Collects a body in memory, moving it to disk when it gets too big.'''
+
+    def __init__(self, threshold=None, budget=None):
+        self.threshold = threshold
+        self.budget = budget or MemoryBudget()
+        self.parts = []
+        self.size = 0
+        self.reserved = 0
+        self.file = None
+
+    def write(self, chunk):
+        if self.file is None:
+            if ((self.threshold is None or
+                 self.size + len(chunk) <= self.threshold) and
+                    self.budget.reserve(len(chunk))):
+                self.parts.append(chunk)
+                self.reserved += len(chunk)
+                self.size += len(chunk)
+                return
+            self.file = tempfile.TemporaryFile()
+            self.file.writelines(self.parts)
+            self.parts = []
+            self.budget.release(self.reserved)
+            self.reserved = 0
+        self.file.write(chunk)
+        self.size += len(chunk)
+
+    @property
+    def spilled(self):
+        return self.file is not None
+
+    def getvalue(self):
+        '''Return the body, if it was kept in memory.'''
+        return ''.join(self.parts)
+
+    def iter_chunks(self, chunk_size=64 * 1024):
+        '''Yield the body in chunks, from memory or from disk.'''
+        if self.file is None:
+            for part in self.parts:
+                yield part
+            return
+        self.file.seek(0)
+        while True:
+            chunk = self.file.read(chunk_size)
+            if not chunk:
+                return
+            yield chunk
+
+    def close(self):
+        self.budget.release(self.reserved)
+        self.reserved = 0
+        self.parts = []
+        if self.file is not None:
+            self.file.close()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc_info):
+        self.close()
+
+
+def spool(chunks, threshold=None, budget=None):
+    '''Read an iterable of chunks into a Spool.'''
+    result = Spool(threshold, budget)
+    try:
+        for chunk in chunks:
+            result.write(chunk)
+    except:
+        result.close()
+        raise
+    return result
@@ -0,0 +1,172 @@
+"""Recording and replaying of API traffic.
+
+A transport is any callable with the signature of requests.request();
+ConcurClient.api sends every request through client.transport.
+
+RecordingTransport passes requests on to another transport and appends
+each exchange to a gzipped JSON-lines archive, with OAuth tokens and
+secrets redacted; each exchange is a gzip member of its own, so the
+archive can be read up to the last whole exchange even if the recorder
+dies.  ReplayTransport answers requests from such an archive without
+touching the network, either at full speed or with the recorded response
+times:
+
+    client.transport = RecordingTransport('traffic.jsonl.gz')
+    ...
+    client.transport = ReplayTransport('traffic.jsonl.gz', timing='original')
+
+To profile response handling alone, feed iter_responses() straight to
+ConcurClient.validate_response().
+"""
+
+from collections import deque
+from datetime import timedelta
+import gzip
+import json
+try:
+    from cStringIO import StringIO
+except ImportError:
+    from StringIO import StringIO
+import re
+import threading
+import time
+import urllib
+import urlparse
+import zlib
+
+import requests
+from requests.structures import CaseInsensitiveDict
+
+from _concur import ConcurAPIError
+
+# Query parameters whose values are never written to an archive.
+secret_params = frozenset(['access_token', 'client_secret', 'code',
+                           'refresh_token'])
+# Response headers that are kept.
+kept_headers = ('content-type', 'retry-after', 'location')
+
+_secret_xml = re.compile(r'(<(Token|Refresh_Token)>)[^<]*(</)')
+_secret_json = re.compile(
+    r'("(?:access_token|refresh_token|Token|Refresh_Token)"\s*:\s*")[^"]*(")')
+
+
+def request_key(method, url, params=None):
+    '''Return the redacted "METHOD path?query" used to match exchanges.'''
+    url = requests.Request(method, url, params=params).prepare().url
+    parts = urlparse.urlsplit(url)
+    query = urllib.urlencode([
+        (k, 'REDACTED' if k in secret_params else v)
+        for k, v in urlparse.parse_qsl(parts.query, keep_blank_values=True)])
+    return '%s %s%s' % (method.upper(), parts.path, '?' + query if query else '')
+
+
+def redact_body(body):
+    body = _secret_xml.sub(r'\1REDACTED\3', body)
+    return _secret_json.sub(r'\1REDACTED\2', body)
+
+
+def make_response(entry, url=None):
+    '''Build a requests.Response from an archived exchange.'''
+    response = requests.models.Response()
+    response.status_code = entry['status']
+    response.headers = CaseInsensitiveDict(entry['headers'])
+    response._content = entry['body'].encode('latin-1')
+    response._content_consumed = True
+    response.url = url or entry['key'].split(' ', 1)[1]
+    response.elapsed = timedelta(seconds=entry['elapsed'])
+    response.encoding = requests.utils.get_encoding_from_headers(
+        response.headers)
+    return response
+
+
+def iter_entries(archive, chunk_size=64 * 1024):
+    '''Yield the exchanges in an archive.
+
+An exchange left unfinished by a recorder that died is skipped.  (gzip
+itself would fail on it, and lose the exchange before it as well.)'''
+    decompressor = zlib.decompressobj(16 + zlib.MAX_WBITS)
+    pending = ''
+    with open(archive, 'rb') as fp:
+        for chunk in iter(lambda: fp.read(chunk_size), ''):
+            while chunk:
+                pending += decompressor.decompress(chunk)
+                # Whatever follows the end of a member starts the next.
+                chunk = decompressor.unused_data
+                if chunk:
+                    decompressor = zlib.decompressobj(16 + zlib.MAX_WBITS)
+            lines = pending.split('\n')
+            pending = lines.pop()
+            for line in lines:
+                yield json.loads(line)
+
+
+def iter_responses(archive):
+    '''Yield a requests.Response for each exchange in an archive.'''
+    for entry in iter_entries(archive):
+        yield make_response(entry)
+
+
+class RecordingTransport(object):
+    '''Sends requests through 'transport' and archives each exchange.'''
+
+    def __init__(self, archive, transport=requests.request):
+        self.archive = archive
+        self.transport = transport
+        self._lock = threading.Lock()
+        self._file = open(archive, 'ab')
+
+    def __call__(self, method, url, **kwargs):
+        response = self.transport(method, url, **kwargs)
+        entry = {
+            'key': request_key(method, url, kwargs.get('params')),
+            'elapsed': response.elapsed.total_seconds(),
+            'status': response.status_code,
+            'headers': dict((k, response.headers[k]) for k in kept_headers
+                            if k in response.headers),
+            'body': redact_body(response.content).decode('latin-1'),
+            }
+        member = StringIO()
+        with gzip.GzipFile(fileobj=member, mode='wb') as fp:
+            fp.write(json.dumps(entry, separators=(',', ':')) + '\n')
+        with self._lock:
+            self._file.write(member.getvalue())
+            self._file.flush()
+        return response
+
+    def close(self):
+        with self._lock:
+            self._file.close()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc_info):
+        self.close()
+
+
+class ReplayTransport(object):
+    '''Answers requests from an archive written by RecordingTransport.
+
+Requests are matched on method, path and (redacted) query; repeated
+requests get the recorded responses in order.  With timing='original',
+each response is delayed by the time the real one took.'''
+
+    def __init__(self, archive, timing='fast'):
+        if timing not in ('fast', 'original'):
+            raise ValueError('timing must be "fast" or "original"')
+        self.timing = timing
+        self._lock = threading.Lock()
+        self.exchanges = {}
+        for entry in iter_entries(archive):
+            self.exchanges.setdefault(entry['key'], deque()).append(entry)
+
+    def __call__(self, method, url, **kwargs):
+        key = request_key(method, url, kwargs.get('params'))
+        with self._lock:
+            try:
+                entry = self.exchanges[key].popleft()
+            except (KeyError, IndexError):
+                raise ConcurAPIError('no recorded response for %s' % key)
+        if self.timing == 'original':
+            time.sleep(entry['elapsed'])
+        return make_response(entry, url)
@@ -34,38 +34,98 @@ that completely if it makes more sense...
 R. White, 2006 November 6
 """
 
+from collections import Mapping
+from contextlib import contextmanager
 import json
+import multiprocessing
 import optparse
+import os
+import re
 import sys
+import tempfile
 
 import xml.etree.cElementTree as ET
+from xml.parsers import expat
+try:
+    from lxml import etree as lxml_etree
+except ImportError:
+    lxml_etree = None
+
+# "well-known" namespace prefixes
+well_known_namespaces = {
+    "http://www.w3.org/XML/1998/namespace": "xml",
+    "http://www.w3.org/1999/xhtml": "html",
+    "http://www.w3.org/1999/02/22-rdf-syntax-ns#": "rdf",
+    "http://schemas.xmlsoap.org/wsdl/": "wsdl",
+    # xml schema
+    "http://www.w3.org/2001/XMLSchema": "xs",
+    "http://www.w3.org/2001/XMLSchema-instance": "xsi",
+    # dublin core
+    "http://purl.org/dc/elements/1.1/": "dc",
+}
+
+def namespace_of(qname):
+    """Return the namespace URI of a "{uri}tag" name, or None."""
+
+    if qname and qname[0] == '{':
+        return qname[1:].rsplit("}", 1)[0]
+    return None
 
 class UsingPrefix(object):
-    
+    """Translates between "{uri}tag" names and "prefix:tag" names.
+
+    Building one compiles a regular expression and copies the map of
+    well-known prefixes, so a configured instance can be kept and shared;
+    call fork() to get a cheap instance for each document, since the
+    "ns%d" prefixes invented while encoding are specific to a document.
+    """
+
+    _reserved = {}
+
     def __init__(self, sep=':', default_namespace=None):
-        import re
         self.sep = sep
+        if hasattr(default_namespace, 'tag'):
+            default_namespace = default_namespace.tag
         if default_namespace and default_namespace[0] == '{':
-            default_namespace, tag = tuple(default_namespace[1:].rsplit("}", 1))
+            default_namespace = namespace_of(default_namespace)
         self.default_namespace = default_namespace
-        self.reserved = re.compile(r'^ns\d+$|' + re.escape(self.sep)).search
+        try:
+            self.reserved = self._reserved[sep]
+        except KeyError:
+            self.reserved = self._reserved.setdefault(
+                sep, re.compile(r'^ns\d+$|' + re.escape(sep)).search)
         self.namespace_count = 0
-        self.namespace_map = {
-            # "well-known" namespace prefixes
-            "http://www.w3.org/XML/1998/namespace": "xml",
-            "http://www.w3.org/1999/xhtml": "html",
-            "http://www.w3.org/1999/02/22-rdf-syntax-ns#": "rdf",
-            "http://schemas.xmlsoap.org/wsdl/": "wsdl",
-            # xml schema
-            "http://www.w3.org/2001/XMLSchema": "xs",
-            "http://www.w3.org/2001/XMLSchema-instance": "xsi",
-            # dublin core
-            "http://purl.org/dc/elements/1.1/": "dc",
-        }
-        
-    def register_namespace(prefix, uri):
+        self.namespace_map = dict(well_known_namespaces)
+        self._shared = False
+
+    def __getstate__(self):
+        state = dict(self.__dict__)
+        del state['reserved']
+        return state
+
+    def __setstate__(self, state):
+        self.__dict__.update(state)
+        self.reserved = self._reserved.setdefault(
+            self.sep, re.compile(r'^ns\d+$|' + re.escape(self.sep)).search)
+
+    def fork(self):
+        """Return a copy with its own "ns%d" counter.
+
+        The namespace map is shared until the copy needs to add to it, so
+        forking costs next to nothing.
+        """
+
+        other = object.__new__(type(self))
+        other.__dict__.update(self.__dict__)
+        other._shared = True
+        return other
+
+    def register_namespace(self, prefix, uri):
         if self.reserved(prefix):
             raise ValueError("Prefix format reserved for internal use")
+        if self._shared:
+            self.namespace_map = dict(self.namespace_map)
+            self._shared = False
         for k, v in self.namespace_map.items():
             if k == uri or v == prefix:
                 del self.namespace_map[k]
@@ -79,6 +139,9 @@ class UsingPrefix(object):
             ns_map = self.namespace_map
             prefix = ns_map.get(uri)
             if prefix is None:
+                if self._shared:
+                    self.namespace_map = ns_map = dict(ns_map)
+                    self._shared = False
                 prefix = "ns%d" % self.namespace_count
                 ns_map[uri] = prefix
                 self.namespace_count += 1
@@ -91,6 +154,7 @@ class UsingPrefix(object):
         except ValueError:
             if self.default_namespace:
                 return "{%s}%s" % (self.default_namespace, tag)
+            return tag
         for k, v in self.namespace_map.items():
             if v == prefix:
                 uri = k
@@ -146,6 +210,423 @@ def elem_to_internal(elem, strip=1, canonize=default_canonization):
         d = text or None
     return {canonize.encode(elem.tag): d}
 
+class CompactRecord(object):
+    """A read-only mapping storing its values in slots.
+
+    Records with the same keys in the same order share a subclass (see
+    record_class), which holds the keys once for all of them, so a record
+    costs a small fraction of the equivalent dictionary.  Records compare
+    equal to dictionaries with the same items; json.dumps() needs
+    default=CompactRecord.to_dict to serialize them.
+    """
+
+    __slots__ = ()
+    _keys = ()
+    _index = {}
+
+    def __init__(self, *values):
+        for name, value in zip(self.__slots__, values):
+            setattr(self, name, value)
+
+    def __getitem__(self, key):
+        try:
+            return getattr(self, self._index[key])
+        except KeyError:
+            raise KeyError(key)
+
+    def get(self, key, default=None):
+        name = self._index.get(key)
+        return default if name is None else getattr(self, name)
+
+    def __contains__(self, key):
+        return key in self._index
+
+    def __iter__(self):
+        return iter(self._keys)
+
+    def __len__(self):
+        return len(self._keys)
+
+    def keys(self):
+        return list(self._keys)
+
+    def values(self):
+        return [getattr(self, name) for name in self.__slots__]
+
+    def items(self):
+        return zip(self._keys, self.values())
+
+    iterkeys = __iter__
+
+    def itervalues(self):
+        return iter(self.values())
+
+    def iteritems(self):
+        return iter(self.items())
+
+    def to_dict(self):
+        """Return the record as a dictionary (not recursively)."""
+        return dict(self.items())
+
+    def __eq__(self, other):
+        if isinstance(other, (dict, CompactRecord)):
+            return self.to_dict() == dict(other.items())
+        return NotImplemented
+
+    def __ne__(self, other):
+        equal = self.__eq__(other)
+        return equal if equal is NotImplemented else not equal
+
+    __hash__ = None
+
+    def __repr__(self):
+        return repr(self.to_dict())
+
+    def __reduce__(self):
+        return _make_record, (self._keys, tuple(self.values()))
+
+Mapping.register(CompactRecord)
+
+class _LRUCache(object):
+    """Remembers the values made for about the 'size' most recently used
+    keys.
+
+    Keys are looked up in the current generation, then in the previous
+    one; when the current one fills up it becomes the previous one, and
+    whatever was not used since is dropped.  A hit costs a dictionary
+    lookup.
+    """
+
+    def __init__(self, make, size):
+        self.make = make
+        self.size = size
+        self._current = {}
+        self._previous = {}
+
+    def __call__(self, key):
+        try:
+            return self._current[key]
+        except KeyError:
+            pass
+        current = self._current
+        value = self._previous.get(key, self)
+        if value is self:
+            value = self.make(key)
+        value = current.setdefault(key, value)
+        if len(current) >= self.size:
+            self._previous, self._current = current, {}
+        return value
+
+    def clear(self):
+        self._current = {}
+        self._previous = {}
+
+def _new_record_class(keys):
+    slots = tuple('_%d' % i for i in range(len(keys)))
+    return type('CompactRecord', (CompactRecord,), {
+        '__slots__': slots,
+        '_keys': keys,
+        '_index': dict(zip(keys, slots)),
+        })
+
+# Keys that fall out of the cache get a new class, whose records compare
+# equal to those of the old one.
+_record_classes = _LRUCache(_new_record_class, 4096)
+
+def record_class(keys):
+    """Return the CompactRecord subclass for a tuple of keys."""
+
+    return _record_classes(keys)
+
+def _make_record(keys, values):
+    return record_class(keys)(*values)
+
+# Intern tag and attribute names, which may be unicode.
+_name = _LRUCache(lambda name: name, 16384)
+
+def _elem_to_compact(elem, strip, canonize):
+    keys = []
+    d = {}
+    for key, value in list(elem.attrib.items()):
+        key = _name('@' + key)
+        keys.append(key)
+        d[key] = value
+    for subelem in elem:
+        value = _elem_to_compact(subelem, strip, canonize)
+        tag = _name(canonize.encode(subelem.tag))
+        try:
+            existing = d[tag]
+        except KeyError:
+            keys.append(tag)
+            d[tag] = value
+        else:
+            if isinstance(existing, list):
+                existing.append(value)
+            else:
+                d[tag] = [existing, value]
+    text = elem.text
+    tail = elem.tail
+    if strip:
+        if text:
+            text = text.strip()
+        if tail:
+            tail = tail.strip()
+    if tail:
+        keys.append('#tail')
+        d['#tail'] = tail
+    if not keys:
+        return text or None
+    if text:
+        keys.append('#text')
+        d['#text'] = text
+    return record_class(tuple(keys))(*[d[key] for key in keys])
+
+def elem_to_compact(elem, strip=1, canonize=default_canonization):
+    """Like elem_to_internal(), but with CompactRecords for dictionaries.
+
+    Tag and attribute names are interned, so records share their keys.
+    """
+
+    value = _elem_to_compact(elem, strip, canonize)
+    return {_name(canonize.encode(elem.tag)): value}
+
+def compact(internal):
+    """Convert dictionaries in an internal (or JSON) value to CompactRecords."""
+
+    if isinstance(internal, dict):
+        keys = tuple(_name(key) for key in internal)
+        return record_class(keys)(*[compact(value)
+                                    for value in internal.values()])
+    if isinstance(internal, list):
+        return [compact(value) for value in internal]
+    return internal
+
+@contextmanager
+def _no_timer(phase):
+    yield
+
+class EtreeParser(object):
+    """Parses with ElementTree, then converts the tree.
+
+    Every parser has a to_internal() method which returns the root tag
+    and the internal form of an XML document, given as bytes or as an
+    iterable of chunks of bytes (which are parsed as they arrive); the
+    internal form is the same whichever parser is used.  'canonize_for' is called
+    with the root tag and returns the UsingPrefix to convert with, and
+    'timer', if given, is called with "parse" or "convert" and returns a
+    context manager timing that phase.
+    """
+
+    name = 'etree'
+
+    def parse(self, data):
+        if isinstance(data, basestring):
+            return ET.fromstring(data)
+        parser = ET.XMLParser()
+        for chunk in data:
+            parser.feed(chunk)
+        return parser.close()
+
+    def to_internal(self, data, canonize_for, strip=1, compact=False,
+                    timer=_no_timer):
+        with timer('parse'):
+            root = self.parse(data)
+        convert = elem_to_compact if compact else elem_to_internal
+        with timer('convert'):
+            return root.tag, convert(root, strip=strip,
+                                     canonize=canonize_for(root.tag))
+
+class LxmlParser(EtreeParser):
+    """Parses with lxml, which is faster than ElementTree."""
+
+    name = 'lxml'
+
+    def parse(self, data):
+        # lxml parsers should not be shared between threads.
+        parser = lxml_etree.XMLParser(
+            remove_comments=True, remove_pis=True, no_network=True,
+            huge_tree=True)
+        if isinstance(data, basestring):
+            return lxml_etree.fromstring(data, parser)
+        for chunk in data:
+            parser.feed(chunk)
+        return parser.close()
+
+_non_ascii = re.compile('[\x80-\xff]').search
+
+def _native(s):
+    # Like ElementTree, return ASCII text as str and the rest as unicode.
+    return s.decode('utf-8') if _non_ascii(s) else s
+
+class ExpatParser(object):
+    """Builds the internal form straight from expat's events, without
+    an intermediate tree.  See EtreeParser for the interface.
+
+    As with the other parsers, undefined and external entities raise
+    ParseError; external parameter entities are never read.
+    """
+
+    name = 'expat'
+
+    def to_internal(self, data, canonize_for, strip=1, compact=False,
+                    timer=_no_timer):
+        with timer('parse'):
+            return self._build(data, canonize_for, strip, compact)
+
+    def _build(self, data, canonize_for, strip, compact):
+        parser = expat.ParserCreate(namespace_separator='}')
+        parser.returns_unicode = False
+        parser.buffer_text = True
+        parser.buffer_size = 1 << 16
+        names = {}
+        # Each open element is [tag, keys, d, text, pending], where
+        # 'pending' is the last closed child as [key, frame, tail], kept
+        # until its tail is complete.
+        stack = []
+        state = {'canonize': None, 'root': None}
+
+        def qname(name):
+            try:
+                return names[name]
+            except KeyError:
+                tag = _native('{' + name if '}' in name else name)
+                return names.setdefault(name, tag)
+
+        def value_of(frame, tail):
+            tag, keys, d, text, pending = frame
+            text = ''.join(text)
+            if text:
+                text = _native(text)
+            if tail:
+                tail = _native(''.join(tail))
+            if strip:
+                if text:
+                    text = text.strip()
+                if tail:
+                    tail = tail.strip()
+            if tail:
+                keys.append('#tail')
+                d['#tail'] = tail
+            if not d:
+                return text or None
+            if text:
+                keys.append('#text')
+                d['#text'] = text
+            if compact:
+                return record_class(tuple(keys))(*[d[key] for key in keys])
+            return d
+
+        def settle(frame):
+            key, child, tail = frame[4]
+            frame[4] = None
+            value = value_of(child, tail)
+            keys, d = frame[1], frame[2]
+            try:
+                existing = d[key]
+            except KeyError:
+                keys.append(key)
+                d[key] = value
+            else:
+                if isinstance(existing, list):
+                    existing.append(value)
+                else:
+                    d[key] = [existing, value]
+
+        def start(name, attrs):
+            tag = qname(name)
+            if stack:
+                if stack[-1][4] is not None:
+                    settle(stack[-1])
+            else:
+                state['canonize'] = canonize_for(tag)
+            keys = []
+            d = {}
+            for key, value in attrs.items():
+                key = '@' + qname(key)
+                if compact:
+                    key = _name(key)
+                keys.append(key)
+                d[key] = _native(value)
+            stack.append([tag, keys, d, [], None])
+
+        def end(name):
+            frame = stack.pop()
+            if frame[4] is not None:
+                settle(frame)
+            key = state['canonize'].encode(frame[0])
+            if compact:
+                key = _name(key)
+            if stack:
+                stack[-1][4] = [key, frame, []]
+            else:
+                state['root'] = frame[0], {key: value_of(frame, None)}
+
+        def characters(text):
+            if stack:
+                frame = stack[-1]
+                if frame[4] is not None:
+                    frame[4][2].append(text)
+                else:
+                    frame[3].append(text)
+
+        def undefined(name):
+            raise ET.ParseError('undefined entity &%s;: line %d, column %d' %
+                                (name, parser.CurrentLineNumber,
+                                 parser.CurrentColumnNumber))
+
+        def skipped(name, is_parameter_entity):
+            # expat skips entities it was not shown the declaration of.
+            if not is_parameter_entity:
+                undefined(name)
+
+        def external(context, base, system_id, public_id):
+            # The context ends with the entity's name, after any namespace
+            # bindings, each followed by a form feed.
+            undefined(context.split('\f')[-1])
+
+        parser.StartElementHandler = start
+        parser.EndElementHandler = end
+        parser.CharacterDataHandler = characters
+        parser.SkippedEntityHandler = skipped
+        parser.ExternalEntityRefHandler = external
+        parser.SetParamEntityParsing(expat.XML_PARAM_ENTITY_PARSING_NEVER)
+        try:
+            if isinstance(data, basestring):
+                parser.Parse(data, True)
+            else:
+                for chunk in data:
+                    parser.Parse(chunk, False)
+                parser.Parse('', True)
+        except expat.ExpatError as e:
+            raise ET.ParseError(str(e))
+        return state['root']
+
+xml_parsers = {}
+xml_parser_preference = ['lxml', 'etree']
+
+def register_xml_parser(name, parser):
+    """Make an XML parser (see EtreeParser) available by name."""
+
+    xml_parsers[name] = parser
+
+register_xml_parser('etree', EtreeParser())
+register_xml_parser('expat', ExpatParser())
+if lxml_etree is not None:
+    register_xml_parser('lxml', LxmlParser())
+
+def get_xml_parser(name='auto'):
+    """Return the named XML parser, or for "auto", the first available
+    one in xml_parser_preference."""
+
+    if name == 'auto':
+        for name in xml_parser_preference:
+            if name in xml_parsers:
+                break
+    try:
+        return xml_parsers[name]
+    except KeyError:
+        raise ValueError('unknown XML parser: %r' % name)
+
 def internal_to_elem(pfsh, factory=ET.Element, canonize=default_canonization):
 
     """Convert an internal dictionary (not JSON!) into an Element.
@@ -164,7 +645,7 @@ def internal_to_elem(pfsh, factory=ET.Element, canonize=default_canonization):
         raise ValueError("Illegal structure with multiple tags: %s" % tag)
     tag = tag[0]
     value = pfsh[tag]
-    if isinstance(value, dict):
+    if isinstance(value, (dict, CompactRecord)):
         for k, v in list(value.items()):
             if k[:1] == "@":
                 attribs[k[1:]] = v
@@ -186,6 +667,74 @@ def internal_to_elem(pfsh, factory=ET.Element, canonize=default_canonization):
     e.tail = tail
     return e
 
+def json_to_internal(obj, root=None):
+    """Normalize decoded JSON into the shape elem_to_internal() produces.
+
+    Scalars become text (or None), and empty objects become None.  If
+    'root' is given, the result is wrapped in a dictionary keyed by it,
+    as an XML root element would be.
+    """
+
+    if isinstance(obj, dict):
+        obj = dict((k, json_to_internal(v)) for k, v in obj.items()) or None
+    elif isinstance(obj, list):
+        obj = [json_to_internal(v) for v in obj]
+    elif isinstance(obj, bool):
+        obj = u'true' if obj else u'false'
+    elif obj is not None and not isinstance(obj, basestring):
+        obj = unicode(obj)
+    elif not obj:
+        obj = None
+    if root is not None:
+        obj = {root: obj}
+    return obj
+
+def as_list(value):
+    """Return the value of a repeatable element as a list: empty for None,
+    and of one item for an element that occurred once."""
+
+    if value is None:
+        return []
+    return value if isinstance(value, list) else [value]
+
+def unwrap(parsed, root=None):
+    """Strip the root element from a parsed response, giving {} for an
+    empty one.  With 'root', only a root element of that name is stripped;
+    anything else is returned unchanged."""
+
+    mapping = (dict, CompactRecord)
+    if isinstance(parsed, mapping) and len(parsed) == 1:
+        if root is None or parsed.keys() == [root]:
+            value, = parsed.values()
+            if isinstance(value, mapping) or value is None:
+                return value or {}
+    return parsed
+
+def iter_records(internal):
+    """Yield the records in an internal dictionary (or an iterable of them).
+
+    Single-key dictionaries, such as the one holding the root element,
+    are looked through; then the items of the first list found are the
+    records, or failing that, the dictionary itself is the only record.
+    """
+
+    mapping = (dict, CompactRecord)
+    if not isinstance(internal, mapping):
+        for record in internal:
+            yield record
+        return
+    while isinstance(internal, mapping) and len(internal) == 1:
+        value, = internal.values()
+        if not isinstance(value, mapping):
+            break
+        internal = value
+    for value in internal.values():
+        if isinstance(value, list):
+            for record in value:
+                yield record
+            return
+    yield internal
+
 def elem2json(elem, strip=1):
     """Convert an ElementTree or Element into a JSON string."""
 
@@ -203,11 +752,13 @@ def json2elem(json_data, factory=ET.Element):
 
     return internal_to_elem(json.loads(json_data), factory)
 
-def xml2json(xmlstring, strip=1):
-    """Convert an XML string into a JSON string."""
+def xml2json(xmlstring, strip=1, parser='etree'):
+    """Convert an XML string into a JSON string, using the named parser
+    (see get_xml_parser)."""
 
-    elem = ET.fromstring(xmlstring)
-    return elem2json(elem, strip=strip)
+    tag, internal = get_xml_parser(parser).to_internal(
+        xmlstring, lambda tag: UsingPrefix(), strip=strip)
+    return json.dumps(internal)
 
 
 def json2xml(json_data, factory=ET.Element):
@@ -221,34 +772,348 @@ def json2xml(json_data, factory=ET.Element):
     elem = internal_to_elem(json.loads(json_data), factory)
     return ET.tostring(elem)
 
+def _local_name(tag):
+    return tag.rsplit('}', 1)[-1]
+
+def iter_xml_records(source, record=None, strip=1, compact=False):
+    """Yield the records of an XML file or file object, in internal form.
+
+    The input is parsed incrementally and each record is discarded once
+    it has been converted, so memory use does not grow with the size of
+    the input.  The records are the children of the root element, or if
+    'record' is given, the outermost elements with that (local) name.
+    With 'compact', they are converted with elem_to_compact().  Names are
+    encoded as xml2json() would encode them in the whole document.
+    """
+
+    convert = elem_to_compact if compact else elem_to_internal
+    # Elements outside the records are encoded as they end, in the order
+    # elem_to_internal() encodes them, so that "ns%d" prefixes agree.
+    canonize = UsingPrefix()
+    stack = []
+    current = None
+    for event, elem in ET.iterparse(source, events=('start', 'end')):
+        if event == 'start':
+            stack.append(elem)
+            if current is None and (
+                    len(stack) == 2 if record is None
+                    else _local_name(elem.tag) == record):
+                current = elem
+            continue
+        stack.pop()
+        if elem is current:
+            yield convert(elem, strip=strip, canonize=canonize)
+            current = None
+        elif current is None:
+            canonize.encode(elem.tag)
+        if current is None and stack:
+            elem.clear()
+            stack[-1].remove(elem)
+
+def _tag_end(data, i):
+    # Return the index just past the tag starting at data[i].
+    quote = None
+    while True:
+        c = data[i]
+        if quote:
+            if c == quote:
+                quote = None
+        elif c == '"' or c == "'":
+            quote = c
+        elif c == '>':
+            return i + 1
+        i += 1
+
+def _split_records(data, canonize, chunk_size):
+    """Find where the children of the root element start and end.
+
+    Every element name is encoded with 'canonize', in the order
+    elem_to_internal() would encode them, so that its "ns%d" prefixes come
+    out the same however the children are divided up.  Returns the indexes
+    of the root's start tag and of its first child, the (start, end)
+    slices holding the children, in runs of about 'chunk_size' bytes, and
+    the index of the root's end tag.
+    """
+
+    parser = expat.ParserCreate(namespace_separator='}')
+    seen = set()
+    starts = []
+    bounds = []
+    depth = [0]
+
+    def start(name, attrs):
+        depth[0] += 1
+        if depth[0] == 2:
+            starts.append(parser.CurrentByteIndex)
+        elif depth[0] == 1:
+            bounds.append(parser.CurrentByteIndex)
+
+    def end(name):
+        depth[0] -= 1
+        if name not in seen:
+            seen.add(name)
+            canonize.encode('{' + name if '}' in name else name)
+        if not depth[0]:
+            bounds.append(parser.CurrentByteIndex)
+
+    parser.StartElementHandler = start
+    parser.EndElementHandler = end
+    parser.Parse(data, True)
+    root_start, root_end = bounds
+
+    chunks = []
+    if starts:
+        first = starts[0]
+        for i in starts[1:] + [root_end]:
+            if i - first >= chunk_size or i == root_end:
+                chunks.append((first, i))
+                first = i
+    return root_start, (starts[0] if starts else None), chunks, root_end
+
+def _convert_chunk(task):
+    document, strip, canonize = task
+    return [next(iter(elem_to_internal(child, strip=strip,
+                                       canonize=canonize).items()))
+            for child in ET.fromstring(document)]
+
+def _chunk_tasks(data, strip, canonize, chunk_size):
+    start, first, chunks, end = _split_records(data, canonize, chunk_size)
+    if first is None:
+        return None, []
+    head = data[:_tag_end(data, start)]
+    tail = data[end:]
+    tasks = [(head + data[a:b] + tail, strip, canonize) for a, b in chunks]
+    return data[:first] + tail, tasks
+
+def _run_tasks(tasks, processes, pool, ordered):
+    own_pool = pool is None
+    if own_pool:
+        pool = multiprocessing.Pool(processes)
+    try:
+        mapper = pool.imap if ordered else pool.imap_unordered
+        for pairs in mapper(_convert_chunk, tasks):
+            yield pairs
+    finally:
+        if own_pool:
+            pool.terminate()
+
+def xml_to_internal_parallel(data, strip=1, canonize=default_canonization,
+                             processes=None, chunk_size=1 << 20, pool=None):
+    """Convert an XML document, given as bytes, using several processes.
+
+    The children of the root element are divided into runs of about
+    'chunk_size' bytes, converted in a multiprocessing pool ('pool', or a
+    new one of 'processes' processes), and merged in order.  The result is
+    the same as elem_to_internal(ET.fromstring(data), strip, canonize).
+    """
+
+    root_only, tasks = _chunk_tasks(data, strip, canonize, chunk_size)
+    if not tasks:
+        return elem_to_internal(ET.fromstring(data), strip=strip,
+                                canonize=canonize)
+    root = ET.fromstring(root_only)
+    d = {}
+    for key, value in list(root.attrib.items()):
+        d['@' + key] = value
+    for pairs in _run_tasks(tasks, processes, pool, True):
+        for tag, value in pairs:
+            try:
+                d[tag].append(value)
+            except AttributeError:
+                d[tag] = [d[tag], value]
+            except KeyError:
+                d[tag] = value
+    text = root.text
+    if strip and text:
+        text = text.strip()
+    if d:
+        if text:
+            d["#text"] = text
+    else:
+        d = text or None
+    return {canonize.encode(root.tag): d}
+
+def iter_records_parallel(data, strip=1, canonize=default_canonization,
+                          processes=None, chunk_size=1 << 20, pool=None,
+                          ordered=True):
+    """Yield each child of the root element of an XML document, in
+    internal form, converting them in several processes.
+
+    With 'ordered' false, runs of children are yielded as soon as they
+    are converted rather than in document order.
+    """
+
+    root_only, tasks = _chunk_tasks(data, strip, canonize, chunk_size)
+    for pairs in _run_tasks(tasks, processes, pool, ordered):
+        for tag, value in pairs:
+            yield {tag: value}
+
+def _replace(src, dst):
+    # os.rename() will not replace a file on Windows.
+    if os.name == 'nt' and os.path.exists(dst):
+        os.remove(dst)
+    os.rename(src, dst)
+
+@contextmanager
+def _replacing(dest):
+    # Yield a temporary file beside 'dest', which replaces 'dest' if the
+    # block succeeds and is removed if it fails.
+    directory = os.path.dirname(os.path.abspath(dest))
+    fd, temp = tempfile.mkstemp(dir=directory, prefix='.xml2json')
+    try:
+        with os.fdopen(fd, 'wb') as out:
+            yield out
+        # mkstemp() creates the file readable by its owner only.
+        umask = os.umask(0)
+        os.umask(umask)
+        os.chmod(temp, 0o666 & ~umask)
+        _replace(temp, dest)
+    except:
+        os.remove(temp)
+        raise
+
+def convert_file(source, dest, type='xml2json', lines=False, record=None,
+                 parser='etree'):
+    """Convert one file, writing the result to 'dest' atomically.
+
+    With 'lines', XML is streamed to JSON Lines, one record per line (see
+    iter_xml_records); otherwise XML is read with the named 'parser'.
+    Returns the number of records (or documents) written.
+    """
+
+    with _replacing(dest) as out:
+        if type == 'xml2json' and lines:
+            count = 0
+            for internal in iter_xml_records(source, record=record):
+                out.write(json.dumps(internal))
+                out.write('\n')
+                count += 1
+        else:
+            with open(source, 'rb') as f:
+                input = f.read()
+            if type == 'xml2json':
+                out.write(xml2json(input, strip=0, parser=parser))
+            else:
+                out.write(json2xml(input))
+            count = 1
+    return count
+
+def _convert_task(task):
+    source, dest, options = task
+    try:
+        return source, dest, convert_file(source, dest, **options), None
+    except Exception as e:
+        return source, dest, 0, '%s: %s' % (type(e).__name__, e)
+
+def _inputs(arguments, type):
+    extension = '.xml' if type == 'xml2json' else '.json'
+    for argument in arguments:
+        if os.path.isdir(argument):
+            for name in sorted(os.listdir(argument)):
+                if name.lower().endswith(extension):
+                    yield os.path.join(argument, name)
+        else:
+            yield argument
+
 def main():
     p = optparse.OptionParser(
         description='Converts XML to JSON or the other way around',
         prog='xml2json',
-        usage='%prog -t xml2json -o file.json file.xml'
+        usage='%prog -t xml2json -o file.json file.xml\n'
+              '       %prog -t xml2json -l -d outdir file.xml|directory ...'
     )
     p.add_option('--type', '-t', help="'xml2json' or 'json2xml'")
     p.add_option('--out', '-o', help="Write to OUT instead of stdout")
+    p.add_option('--lines', '-l', action='store_true',
+                 help="Stream XML to JSON Lines, one record per line")
+    p.add_option('--record', '-r',
+                 help="Name of the record elements (default: the children "
+                      "of the root)")
+    p.add_option('--outdir', '-d',
+                 help="Write each output to OUTDIR (default: beside its input)")
+    p.add_option('--parser', '-p',
+                 help="XML parser for whole documents: %s or auto "
+                      "(default: etree)" % ", ".join(sorted(xml_parsers)))
+    p.add_option('--jobs', '-j', type='int',
+                 help="Number of files to convert at once (default: one per "
+                      "CPU); with a single file, convert its records in "
+                      "JOBS processes")
     options, arguments = p.parse_args()
+    type = options.type or 'json2xml'
 
-    if len(arguments) == 1:
-        input = open(arguments[0]).read()
-    else:
+    if not arguments:
         p.print_help()
         sys.exit(-1)
+    single = (len(arguments) == 1 and not os.path.isdir(arguments[0])
+              and not options.outdir)
+    if options.parser and (type != 'xml2json' or options.lines or
+                           single and options.jobs):
+        p.error('--parser only applies to xml2json without --lines or, '
+                'for a single file, --jobs')
+    parser = options.parser or 'etree'
+    try:
+        get_xml_parser(parser)
+    except ValueError as e:
+        p.error(str(e))
 
-    if (options.type == "xml2json"):
-        out = xml2json(input, strip=0)
-    else:
-        out = json2xml(input)
+    if single:
+        if options.lines and type == 'xml2json':
+            if options.out:
+                convert_file(arguments[0], options.out, type, True,
+                             options.record)
+            else:
+                for internal in iter_xml_records(arguments[0],
+                                                 record=options.record):
+                    print(json.dumps(internal))
+            return
+        input = open(arguments[0]).read()
+        if (type == "xml2json" and options.jobs):
+            out = json.dumps(xml_to_internal_parallel(
+                input, strip=0, canonize=UsingPrefix(),
+                processes=options.jobs))
+        elif (type == "xml2json"):
+            out = xml2json(input, strip=0, parser=parser)
+        else:
+            out = json2xml(input)
 
-    if (options.out):
-        file = open(options.out, 'w')
-        file.write(out)
-        file.close()
+        if (options.out):
+            with _replacing(options.out) as file:
+                file.write(out)
+        else:
+            print(out)
+        return
+
+    if options.out:
+        p.error('use --outdir with more than one input')
+    if type == 'xml2json':
+        extension = '.jsonl' if options.lines else '.json'
     else:
-        print(out)
+        extension = '.xml'
+    convert = dict(type=type, lines=options.lines, record=options.record,
+                   parser=parser)
+    tasks = []
+    for source in _inputs(arguments, type):
+        name = os.path.splitext(os.path.basename(source))[0] + extension
+        directory = options.outdir or os.path.dirname(source)
+        tasks.append((source, os.path.join(directory, name), convert))
+    if options.outdir and not os.path.isdir(options.outdir):
+        os.makedirs(options.outdir)
+
+    pool = multiprocessing.Pool(options.jobs)
+    failed = 0
+    try:
+        for source, dest, count, error in pool.imap_unordered(_convert_task,
+                                                              tasks):
+            if error:
+                failed += 1
+                sys.stderr.write('%s: %s\n' % (source, error))
+            else:
+                sys.stderr.write('%s -> %s (%d)\n' % (source, dest, count))
+    finally:
+        pool.close()
+        pool.join()
+    if failed:
+        sys.exit(1)
 
 if __name__ == "__main__":
     main()
-
@@ -4,11 +4,15 @@ dictionary has all required and no extraneous keys.  This is generally
 used to validate keyword parameters for function definitions.
 '''
 
+from collections import OrderedDict as _OrderedDict
+from datetime import datetime
 import re as _re
+import threading as _threading
 
 
 class _DictRe(dict):
     repl = lambda self, matchobj: self.get(matchobj.group(), '')
+    cache_size = 256
 
     def compile(self, flags=0, pattern=None):
         '''Compile a regular expression consisting of the alternation
@@ -19,6 +23,8 @@ such as, "x = _DictRe(...).compile()"'''
         self.pattern = pattern if pattern else '|'.join(_re.escape(key) for key in sorted(self.keys()))
         self.re  = _re.compile(self.pattern, flags)
         self.flags = self.re.flags
+        self._cache = _OrderedDict()
+        self._cache_lock = _threading.Lock()
         return self
 
     def sub(self, string, count=0):
@@ -31,18 +37,77 @@ such as, "x = _DictRe(...).compile()"'''
         (new_string, number_of_subs_made).'''
         return self.re.subn(self.repl, string, count)
 
+    def sub_cached(self, string):
+        '''Perform the same operation as sub(), remembering the results
+        for the cache_size most recently used strings.'''
+        cache = self._cache
+        with self._cache_lock:
+            if string in cache:
+                result = cache[string] = cache.pop(string)
+                return result
+        result = self.re.sub(self.repl, string)
+        with self._cache_lock:
+            cache[string] = result
+            if len(cache) > self.cache_size:
+                cache.popitem(last=False)
+        return result
+
+
+# Patterns that values of each field type must match.
+_field_types = {
+    'string': None,
+    'decimal': _re.compile(r'-?\d+(?:\.\d+)?$').match,
+    'integer': _re.compile(r'-?\d+$').match,
+    'boolean': _re.compile(r'(?:[YN]|true|false)$', _re.I).match,
+    'currency': _re.compile(r'[A-Z]{3}$').match,
+    'country': _re.compile(r'[A-Z]{2}$').match,
+    'date': _re.compile(r'\d{4}-\d{2}-\d{2}$').match,
+    'datetime': _re.compile(
+        r'\d{4}-\d{2}-\d{2}(?:[ T]\d{2}:\d{2}(?::\d{2}(?:\.\d+)?)?)?$').match,
+    }
+
+
+def compile_field(name, type='string', max_length=None, choices=None):
+    '''Return a function that raises ValueError unless a value of the
+field 'name' has the given type, length and (optionally) value.
+Numbers are checked as their text; other values that are not text are
+invalid.'''
+    match = _field_types[type]
+    choices = frozenset(choices) if choices else None
+    def check(value):
+        if value is None:
+            return
+        if isinstance(value, (int, long, float)) and not isinstance(value, bool):
+            value = str(value)
+        elif not isinstance(value, basestring):
+            raise ValueError('%s: %r is not text' % (name, value))
+        if match is not None and not match(value):
+            raise ValueError('%s: %r is not a valid %s' % (name, value, type))
+        if max_length is not None and len(value) > max_length:
+            raise ValueError('%s: longer than %d characters' % (name, max_length))
+        if choices is not None and value not in choices:
+            raise ValueError('%s: %r is not one of %s' %
+                             (name, value, ', '.join(sorted(choices))))
+    return check
+
 
 class ValidateElements(object):
-    def __init__(self, required, optional, mapping=lambda x: x):
+    def __init__(self, required, optional, mapping=lambda x: x,
+                 batch_mapping=None, fields=None):
         self.required = frozenset(required)
         self.acceptable = self.required.union(optional)
         self.mapping = mapping
+        self.batch_mapping = batch_mapping
+        self.checks = dict((name, compile_field(name, **spec))
+                           for name, spec in (fields or {}).items())
     def __call__(self, options):
         result = {}
         found = set()
         for k, v in options:
             if k in self.acceptable:
                 result[k] = self.mapping(v)
+                if k in self.checks:
+                    self.checks[k](result[k])
                 if k in self.required:
                     found.add(k)
             else:
@@ -50,6 +115,64 @@ class ValidateElements(object):
         if self.required != found:
             raise KeyError('missing key(s): %r' % list(self.required - found))
         return result
+
+    def _validate(self, row, mapping):
+        '''Return the mapped row and a list of its problems.'''
+        acceptable = self.acceptable
+        checks = self.checks
+        result = {}
+        problems = []
+        for k, v in row:
+            if k not in acceptable:
+                problems.append('invalid key: %r' % k)
+                continue
+            try:
+                v = result[k] = mapping(v)
+            except (TypeError, ValueError) as error:
+                problems.append('invalid value for %r: %s' % (k, error))
+                continue
+            if k in checks:
+                try:
+                    checks[k](v)
+                except ValueError as error:
+                    problems.append(str(error))
+        missing = self.required.difference(result)
+        if missing:
+            problems.append('missing key(s): %r' % list(missing))
+        return result, problems
+
+    def check(self, record):
+        '''Raise ValueError if an already mapped record is not valid.'''
+        result, problems = self._validate(record.iteritems(), lambda x: x)
+        if problems:
+            raise ValueError('; '.join(problems))
+
+    def validate_many(self, rows, header=None, now=None):
+        '''Validate many rows in one pass, collecting every error.
+
+Each row is a dictionary or a sequence of (key, value) pairs or, if a
+'header' of keys is given, a sequence of values.  If the validator has
+a batch_mapping, it is called once with 'now' (default: the current
+time) to get the mapping used for the whole batch.  Returns a list with
+the validated dictionary for each row (None if it had errors) and a
+dictionary mapping row indexes to lists of error messages.'''
+        if self.batch_mapping:
+            mapping = self.batch_mapping(now or datetime.now())
+        else:
+            mapping = self.mapping
+        results = []
+        errors = {}
+        for n, row in enumerate(rows):
+            if header is not None:
+                row = zip(header, row)
+            elif isinstance(row, dict):
+                row = row.iteritems()
+            result, problems = self._validate(row, mapping)
+            if problems:
+                errors[n] = problems
+                result = None
+            results.append(result)
+        return results, errors
         
 
 _fix_dates_re = _DictRe((
@@ -65,23 +188,100 @@ _fix_dates_re = _DictRe((
     ('HH:MM:SS', '%H:%M:%S'),
     )).compile(pattern='YY(?:YY)?|M{2,4}|D{2,4}|HH\:MM(?:\:SS)?')
 
+def _template(value):
+    # Date templates are text; say so, rather than fail on value.replace.
+    if not isinstance(value, basestring):
+        raise TypeError('%r is not text' % (value,))
+    return value
+
 def fix_dates(str):
-    return datetime.now().strftime(_fix_dates_re.sub(str.replace('+', ' ')))
-
-validate_report_elements = ValidateElements(['Name'],
-    ['Name', 'Purpose', 'Comment', 'OrgUnit1', 'OrgUnit2', 'OrgUnit3',
-     'OrgUnit4', 'OrgUnit5', 'OrgUnit6', 'Custom1', 'Custom2',
-     'Custom3', 'Custom4', 'Custom5', 'Custom6', 'Custom7', 'Custom8',
-     'Custom9', 'Custom10', 'Custom11', 'Custom12', 'Custom13',
-     'Custom14', 'Custom15', 'Custom16', 'Custom17', 'Custom18',
-     'Custom19', 'Custom20', 'UserDefinedDate'],
-    mapping=fix_dates)
-
-validate_quickexpense_elements = ValidateElements(
-    ['CurrencyCode', 'TransactionAmount', 'TransactionDate'],
-    ['ExpenseTypeCode', 'SpendCategoryCode', 'PaymentType',
-     'LocationCity', 'LocationSubdivision', 'LocationCountry',
-     'VendorDescription', 'Comment', 'ImageBase64'] )
+    _template(str)
+    return datetime.now().strftime(_fix_dates_re.sub_cached(str.replace('+', ' ')))
+
+def fix_dates_many(templates, now=None):
+    '''Render many templates against one timestamp (default: now).'''
+    now = now or datetime.now()
+    sub = _fix_dates_re.sub_cached
+    return [now.strftime(sub(str.replace('+', ' '))) for str in templates]
+
+def fix_dates_at(now):
+    '''Return a version of fix_dates() for a batch: it uses the time 'now'
+and renders each distinct template only once.'''
+    cache = {}
+    def fix(str):
+        try:
+            return cache[_template(str)]
+        except KeyError:
+            result = cache[str] = now.strftime(
+                _fix_dates_re.sub_cached(str.replace('+', ' ')))
+            return result
+    return fix
+
+# Definitions of the payloads posted to each endpoint, from which the
+# validators below are compiled when this module is loaded.  Each field
+# is described by keyword arguments for compile_field().
+
+_org_unit = dict(max_length=48)
+_custom = dict(max_length=48)
+
+endpoint_definitions = {
+    # See also: https://developer.concur.com/api-documentation/web-services/expense-report/expense-report-header-resource/expense-report-header-resource-post
+    'expense/expensereport/v1.1/Report': dict(
+        required={'Name': dict(max_length=40)},
+        optional=dict(
+            [('Purpose', dict(max_length=500)),
+             ('Comment', dict(max_length=500)),
+             ('UserDefinedDate', dict(type='datetime'))] +
+            [('OrgUnit%d' % i, _org_unit) for i in range(1, 7)] +
+            [('Custom%d' % i, _custom) for i in range(1, 21)]),
+        ),
+    # See also: https://developer.concur.com/api-documentation/web-services/quick-expense/quick-expense-resource/quick-expense-resource-post
+    'expense/expensereport/v1.0/quickexpense': dict(
+        required={
+            'CurrencyCode': dict(type='currency'),
+            'TransactionAmount': dict(type='decimal'),
+            'TransactionDate': dict(type='date'),
+            },
+        optional={
+            'ExpenseTypeCode': dict(max_length=5),
+            'SpendCategoryCode': dict(max_length=5),
+            'PaymentType': dict(max_length=4),
+            'LocationCity': dict(max_length=50),
+            'LocationSubdivision': dict(max_length=6),
+            'LocationCountry': dict(type='country'),
+            'VendorDescription': dict(max_length=64),
+            'Comment': dict(max_length=2000),
+            'ImageBase64': dict(),
+            },
+        ),
+    }
+
+def compile_validator(definition, **kwargs):
+    '''Build a ValidateElements from an endpoint definition.'''
+    fields = dict(definition['required'])
+    fields.update(definition['optional'])
+    return ValidateElements(definition['required'], definition['optional'],
+                            fields=fields, **kwargs)
+
+def payload_validator(validate):
+    '''Adapt a ValidateElements to check the payload passed to
+ConcurClient.post(), whose values are the records to check.'''
+    def check(payload):
+        for record in payload.values():
+            validate.check(record)
+    return check
+
+validate_report_elements = compile_validator(
+    endpoint_definitions['expense/expensereport/v1.1/Report'],
+    mapping=fix_dates, batch_mapping=fix_dates_at)
+
+validate_quickexpense_elements = compile_validator(
+    endpoint_definitions['expense/expensereport/v1.0/quickexpense'])
+
+endpoint_validators = {
+    'expense/expensereport/v1.1/Report': validate_report_elements,
+    'expense/expensereport/v1.0/quickexpense': validate_quickexpense_elements,
+    }
 
 # See also: https://developer.concur.com/api-documentation/draft-documentation/attendee-resource-draft/attendee-resource-get-draft
 
@@ -220,8 +420,12 @@ validate_expensereport_by_id = ValidateElements(
 # See also: https://developer.concur.com/api-documentation/web-services/expense-report/expense-report-resource/expense-report-resource-get
 
 validate_Reports = ValidateElements(
-    ['required'],  # TODO
-    ['optional'], )  # TODO
+    [],
+    ['status', 'ReportCurrency', 'ApprovalStatusCode', 'PaymentStatusCode',
+     'ReportCountry', 'ExpenseTypeCode', 'VendorName', 'BatchID', 'user',
+     'CreateDateBefore', 'CreateDateAfter', 'SubmitDateBefore',
+     'SubmitDateAfter', 'PaidDateBefore', 'PaidDateAfter',
+     'ModifiedDateBefore', 'ModifiedDateAfter', 'Offset', 'Limit'], )
 
 validate_Reports_1 = ValidateElements(
     ['required'],  # TODO
@@ -21,11 +21,16 @@ from argparse import ArgumentParser
 from cmd import Cmd as _Cmd
 from datetime import datetime
 from functools import wraps as _wraps
+from multiprocessing.pool import ThreadPool as _ThreadPool
 from pprint import pprint as _pprint
+from StringIO import StringIO as _StringIO
 import json as _json
 import re
+import sys
+import threading as _threading
 
 from ValidateElements import *
+import csv as _csv
 
 try:
     from concur import ConcurClient, ConcurAPIError
@@ -36,6 +41,7 @@ except ImportError:
     path.insert(0, normpath(join(path[0], '..')))
     from concur import ConcurClient, ConcurAPIError
 import concur._xml2json as x2j
+from concur._xml2json import iter_records
 
 def mk_parser(*args):
     parser = ArgumentParser(
@@ -106,6 +112,34 @@ def _unset(names, dict):
         except KeyError:
             pass
 
+class _ThreadOutput(object):
+    '''A stand-in for sys.stdout that lets each thread capture its output.'''
+
+    def __init__(self, stream):
+        self.stream = stream
+        self.local = _threading.local()
+
+    def capture(self):
+        self.local.__dict__.setdefault('buffers', []).append(_StringIO())
+
+    def release(self):
+        return self.local.buffers.pop().getvalue()
+
+    def write(self, text):
+        buffers = getattr(self.local, 'buffers', None)
+        (buffers[-1] if buffers else self.stream).write(text)
+
+    def __getattr__(self, name):
+        return getattr(self.stream, name)
+
+def _csv_value(value):
+    '''Convert a record's value into something csv can write.'''
+    if isinstance(value, unicode):
+        return value.encode('utf-8')
+    if isinstance(value, (dict, list)):
+        return _json.dumps(value, separators=(',', ':'))
+    return value
+
 no_args = mk_parser()
 filename = mk_parser('filename', {'nargs':'?'})
 value = mk_parser('value', {'nargs':'?'})
@@ -122,10 +156,24 @@ class ConcurCmd(_Cmd):
 
     config_file = '~/.concur_cli.rc'
     oauth_file = '~/concur_oauth.json'
+    workers = 1
+    format = 'pprint'
+    formats = ('pprint', 'json', 'jsonl', 'csv')
+    fields = None
+    # Endpoint templates (see ConcurClient.endpoint_template) that answer
+    # with a list, whose items can be streamed.
+    list_endpoints = frozenset(['expense/expensereport/v2.0/Reports'])
+    # Commands that change the interpreter's state, and so are never run
+    # concurrently with others.
+    serial_commands = frozenset(['quit', 'alias', 'unalias', 'save', 'load',
+        'client_id', 'client_secret', 'access_token', 'osave', 'oload',
+        'workers', 'format', 'fields'])
 
     def __init__(self, config_file=None):
         '''Initializes the interpreter.'''
         self.client = ConcurClient()
+        for path, validator in endpoint_validators.items():
+            self.client.register_validator(path, payload_validator(validator))
         self.aliases = {}
         self.open_files = []
         self.do_load(self.config_file)
@@ -135,8 +183,10 @@ class ConcurCmd(_Cmd):
         try:
             return _Cmd.onecmd(self, line)
         except ConcurAPIError as error:
-            print "%s: %s" % (type(error).__name__, error[0])
-            print error[1]
+            args = error.args or ('',)
+            print "%s: %s" % (type(error).__name__, args[0])
+            for detail in args[1:]:
+                print detail
         except Exception as error:
             print "%s: %s" % (type(error).__name__, error)
             import traceback
@@ -219,10 +269,162 @@ These are some commands to try.
         if exists(config_file):
             self.open_files.append(config_file)
             with open(config_file, 'r') as config:
-                for line in config:
-                    self.onecmd(line)
+                self.run_batch(config, self.workers)
             self.open_files.pop()
 
+    @_syntax(value, dont_split=True)
+    def do_workers(self, namespace):
+        '''Displays or sets the number of commands that load runs at once.'''
+        if namespace.value:
+            self.workers = int(namespace.value)
+        else:
+            print 'workers =', self.workers
+
+    def is_serial(self, line):
+        '''Return True if a command line must not run concurrently.'''
+        name = self.parseline(line)[0]
+        if name in self.aliases:
+            name = self.parseline(self.aliases[name])[0]
+        return name in self.serial_commands
+
+    def run_batch(self, lines, workers=1, tag=False):
+        '''Run command lines, up to 'workers' at a time.
+
+Commands that change the interpreter's state run alone, after the ones
+before them have finished.  Each command's output is printed as a whole,
+in input order; with 'tag', it is printed as soon as the command ends,
+with each line prefixed by the command's line number.  Returns True if a
+quit command was reached.'''
+        lines = [(n, line.strip()) for n, line in enumerate(lines, 1)]
+        lines = [(n, line) for n, line in lines if line]
+        if workers <= 1 and not tag:
+            for n, line in lines:
+                if self.onecmd(line):
+                    return True
+            return False
+
+        output = sys.stdout
+        if not isinstance(output, _ThreadOutput):
+            output = _ThreadOutput(output)
+        def run(item):
+            n, line = item
+            output.capture()
+            try:
+                stop = self.onecmd(line)
+            except Exception as error:
+                # Keep the rest of the batch going.
+                print "%s: %s" % (type(error).__name__, error)
+                stop = False
+            finally:
+                text = output.release()
+            if tag:
+                text = ''.join('[%d] %s' % (n, part)
+                               for part in text.splitlines(True))
+            return stop, text
+
+        saved = sys.stdout, self.stdout
+        sys.stdout = self.stdout = output
+        pool = _ThreadPool(max(workers, 1))
+        try:
+            pending = []
+            for item in lines + [None]:
+                if item is not None and not self.is_serial(item[1]):
+                    pending.append(item)
+                    continue
+                # Run everything queued so far, then the serial command.
+                results = (pool.imap_unordered if tag else pool.imap)(run, pending)
+                pending = []
+                stop = False
+                for stopped, text in results:
+                    output.stream.write(text)
+                    stop = stop or stopped
+                if not stop and item is not None:
+                    stop, text = run(item)
+                    output.stream.write(text)
+                if stop:
+                    return True
+            return False
+        finally:
+            pool.close()
+            sys.stdout, self.stdout = saved
+
+    # Commands related to output.
+
+    @_syntax(value, dont_split=True)
+    def do_format(self, namespace):
+        '''Displays or sets the output format: pprint, json (compact, one
+document per command), jsonl (one record per line) or csv (one record
+per row).  Records are the items of the first list in a result.'''
+        if not namespace.value:
+            print 'format =', self.format
+        elif namespace.value in self.formats:
+            self.format = namespace.value
+        else:
+            print 'unknown format %r' % namespace.value
+
+    @_syntax(define)
+    def do_fields(self, namespace):
+        '''Displays or sets the fields picked out of each record; dotted
+names reach into nested records.  Use "fields -" to show all fields.'''
+        fields = ([namespace.name] if namespace.name else []) + namespace.definition
+        if not fields:
+            print 'fields =', ' '.join(self.fields or ['-'])
+        elif fields == ['-']:
+            self.fields = None
+        else:
+            self.fields = [f for field in fields for f in field.split(',') if f]
+
+    def get_list(self, path, **params):
+        '''GET a path, streaming the items of a list unless they are
+pretty-printed.  Anything but a list_endpoints list is decoded whole.'''
+        if (self.format != 'pprint' and
+                self.client.endpoint_template(path) in self.list_endpoints):
+            params['_decode'] = 'stream'
+        return self.client.get(path, **params)
+
+    def project(self, record):
+        '''Pick the selected fields out of a record.'''
+        result = {}
+        for field in self.fields:
+            value = record
+            for name in field.split('.'):
+                value = value.get(name) if isinstance(value, dict) else None
+            result[field] = value
+        return result
+
+    def output(self, result):
+        '''Write a result in the selected format, a record at a time.'''
+        out = sys.stdout
+        if self.fields:
+            result = (self.project(r) for r in iter_records(result))
+        if self.format == 'pprint':
+            _pprint(result if isinstance(result, (dict, list)) else list(result))
+        elif self.format == 'json':
+            if not isinstance(result, (dict, list)):
+                result = list(result)
+            _json.dump(result, out, separators=(',', ':'))
+            out.write('\n')
+        elif self.format == 'jsonl':
+            for record in iter_records(result):
+                out.write(_json.dumps(record, separators=(',', ':')) + '\n')
+                out.flush()
+        elif self.format == 'csv':
+            records = (r if isinstance(r, dict) else {'value': r}
+                       for r in iter_records(result))
+            fields = self.fields
+            if not fields:
+                # The columns are every key of every record, so all of them
+                # have to be read first; set fields to stream instead.
+                records = list(records)
+                fields = sorted(set(k for r in records for k in r))
+            writer = None
+            for record in records:
+                if writer is None:
+                    writer = _csv.DictWriter(out, fields)
+                    writer.writeheader()
+                writer.writerow(dict((k, _csv_value(v)) for k, v in record.items()))
+                out.flush()
+
     # Commands related to OAuth.
 
     @_syntax(value, dont_split=True)
@@ -267,8 +469,11 @@ These are some commands to try.
     def do_osave(self, namespace):
         '''Saves OAuth information into a JSON file.'''
         oauth_file = _get(namespace.filename, self.oauth_file)
+        client = self.client
         with open(oauth_file, 'w') as fp:
-            _json.dump(self.client.__dict__, fp)
+            _json.dump(dict((name, getattr(client, name)) for name in
+                            ('client_id', 'client_secret', 'access_token')),
+                       fp)
 
     @_syntax(filename, dont_split=True)
     def do_oload(self, namespace):
@@ -284,19 +489,19 @@ These are some commands to try.
     @_syntax(http_request)
     def do_get(self, namespace):
         '''Issues an HTTP GET request'''
-        _pprint(self.client.get('/'.join(namespace.path), **dict(namespace.options)))
+        self.output(self.get_list('/'.join(namespace.path), **dict(namespace.options)))
 
     @_syntax(http_request)
     def do_post(self, namespace):
         '''Issues an HTTP POST request'''
-        _pprint(self.client.post('/'.join(namespace.path))) #, **namespace.options))
+        self.output(self.client.post('/'.join(namespace.path))) #, **namespace.options))
 
     # Commands specific to Concur.
 
     @_syntax(options)
     def do_create_report(self, namespace):
         '''Creates a new expense report'''
-        _pprint(self.client.post(
+        self.output(self.client.post(
             'expense/expensereport/v1.1/Report',
             Report=validate_report_elements(namespace.options),
             _xmlns='http://www.concursolutions.com/api/expense/expensereport/2011/03',
@@ -305,7 +510,7 @@ These are some commands to try.
     @_syntax(options)
     def do_quickexpense(self, namespace):
         '''Creates a new quick expense'''
-        _pprint(self.client.post(
+        self.output(self.client.post(
             'expense/expensereport/v1.0/quickexpense/',
             Report=validate_quickexpense_elements(namespace.options),
             _xmlns='http://www.concursolutions.com/api/expense/expensereport/2010/09',
@@ -317,7 +522,7 @@ These are some commands to try.
     def do_get_attendees_by_id(self, namespace):
         '''Get attendees_by_id'''  # TODO
         options = validate_attendees_by_id(namespace.options)
-        _pprint(self.client.get(
+        self.output(self.client.get(
             'expense/v2.0/attendees/{attendees id}' % options,
             ))
 
@@ -327,7 +532,7 @@ These are some commands to try.
     def do_get_e_receiptandinvoice_by_id(self, namespace):
         '''Get e-receiptandinvoice_by_id'''  # TODO
         options = validate_e_receiptandinvoice_by_id(namespace.options)
-        _pprint(self.client.get(
+        self.output(self.client.get(
             'e-receiptandinvoice/v1.0/{e-receiptandinvoice id}' % options,
             ))
 
@@ -337,7 +542,7 @@ These are some commands to try.
     def do_get_CardCharges(self, namespace):
         '''Get CardCharges'''  # TODO
         options = validate_CardCharges(namespace.options)
-        _pprint(self.client.get(
+        self.output(self.client.get(
             'expense/expensereport/v1.1/CardCharges' % options,
             ))
 
@@ -347,7 +552,7 @@ These are some commands to try.
     def do_get_Delegators(self, namespace):
         '''Get Delegators'''  # TODO
         options = validate_Delegators(namespace.options)
-        _pprint(self.client.get(
+        self.output(self.client.get(
             'expense/expensereport/v1.1/Delegators' % options,
             ))
 
@@ -357,7 +562,7 @@ These are some commands to try.
     def do_get_Attendees(self, namespace):
         '''Get Attendees'''  # TODO
         options = validate_Attendees(namespace.options)
-        _pprint(self.client.get(
+        self.output(self.client.get(
             'expense/expensereport/v1.1/report/{report id}/entry/{entry id}/Attendees' % options,
             ))
 
@@ -365,7 +570,7 @@ These are some commands to try.
     def do_get_Attendees_by_id(self, namespace):
         '''Get Attendees_by_id'''  # TODO
         options = validate_Attendees_by_id(namespace.options)
-        _pprint(self.client.get(
+        self.output(self.client.get(
             'expense/expensereport/v1.1/report/{report id}/entry/{entry id}/Attendees/{Attendees id}' % options,
             ))
 
@@ -375,7 +580,7 @@ These are some commands to try.
     def do_post_Attendees(self, namespace):
         '''Post Attendees'''  # TODO
         options = validate_Attendees(namespace.options)
-        _pprint(self.client.post(
+        self.output(self.client.post(
             'expense/expensereport/v1.1/report/{report id}/entry/{entry id}/Attendees' % options,
             RootTag=options,  # TODO
             _xmlns='http://www.concursolutions.com/api/expense/expensereport/2011/03',  # TODO
@@ -385,7 +590,7 @@ These are some commands to try.
     def do_post_Attendees_1(self, namespace):
         '''Post Attendees_1'''  # TODO
         options = validate_Attendees_1(namespace.options)
-        _pprint(self.client.post(
+        self.output(self.client.post(
             'expense/expensereport/v1.1/report/{report id}/entry/{entry id}/Attendees' % options,
             RootTag=options,  # TODO
             _xmlns='http://www.concursolutions.com/api/expense/expensereport/2011/03',  # TODO
@@ -397,7 +602,7 @@ These are some commands to try.
     def do_post_Itemization(self, namespace):
         '''Post Itemization'''  # TODO
         options = validate_Itemization(namespace.options)
-        _pprint(self.client.post(
+        self.output(self.client.post(
             'expense/expensereport/v1.1/report/{report id}/entry/{entry id}/Itemization' % options,
             RootTag=options,  # TODO
             _xmlns='http://www.concursolutions.com/api/expense/expensereport/2011/03',  # TODO
@@ -409,7 +614,7 @@ These are some commands to try.
     def do_get_entry_by_id(self, namespace):
         '''Get entry_by_id'''  # TODO
         options = validate_entry_by_id(namespace.options)
-        _pprint(self.client.get(
+        self.output(self.client.get(
             'expense/expensereport/v1.1/report/{report id}/entry/{entry id}' % options,
             ))
 
@@ -419,7 +624,7 @@ These are some commands to try.
     def do_post_report(self, namespace):
         '''Post report'''  # TODO
         options = validate_report(namespace.options)
-        _pprint(self.client.post(
+        self.output(self.client.post(
             'expense/expensereport/v1.1/api/expense/expensereport/v1.1/report' % options,
             RootTag=options,  # TODO
             _xmlns='http://www.concursolutions.com/api/expense/expensereport/2011/03',  # TODO
@@ -429,7 +634,7 @@ These are some commands to try.
     def do_post_batch(self, namespace):
         '''Post batch'''  # TODO
         options = validate_batch(namespace.options)
-        _pprint(self.client.post(
+        self.output(self.client.post(
             'expense/expensereport/v1.1/api/expense/expensereport/v1.1/report/batch' % options,
             RootTag=options,  # TODO
             _xmlns='http://www.concursolutions.com/api/expense/expensereport/2011/03',  # TODO
@@ -441,7 +646,7 @@ These are some commands to try.
     def do_get_fop(self, namespace):
         '''Get fop'''  # TODO
         options = validate_fop(namespace.options)
-        _pprint(self.client.get(
+        self.output(self.client.get(
             'travelprofile/v1.0/fop' % options,
             ))
 
@@ -451,7 +656,7 @@ These are some commands to try.
     def do_post_loyalty(self, namespace):
         '''Post loyalty'''  # TODO
         options = validate_loyalty(namespace.options)
-        _pprint(self.client.post(
+        self.output(self.client.post(
             'travelprofile/v1.0/loyalty' % options,
             RootTag=options,  # TODO
             _xmlns='http://www.concursolutions.com/api/expense/expensereport/2011/03',  # TODO
@@ -461,7 +666,7 @@ These are some commands to try.
     def do_post_loyalty_1(self, namespace):
         '''Post loyalty_1'''  # TODO
         options = validate_loyalty_1(namespace.options)
-        _pprint(self.client.post(
+        self.output(self.client.post(
             'travelprofile/v1.0/loyalty' % options,
             RootTag=options,  # TODO
             _xmlns='http://www.concursolutions.com/api/expense/expensereport/2011/03',  # TODO
@@ -473,7 +678,7 @@ These are some commands to try.
     def do_get_User(self, namespace):
         '''Get User'''  # TODO
         options = validate_User(namespace.options)
-        _pprint(self.client.get(
+        self.output(self.client.get(
             'user/v1.0/User' % options,
             ))
 
@@ -481,7 +686,7 @@ These are some commands to try.
     def do_get_User_1(self, namespace):
         '''Get User_1'''  # TODO
         options = validate_User_1(namespace.options)
-        _pprint(self.client.get(
+        self.output(self.client.get(
             'user/v1.0/User' % options,
             ))
 
@@ -491,7 +696,7 @@ These are some commands to try.
     def do_get_attendees_by_id_1(self, namespace):
         '''Get attendees_by_id_1'''  # TODO
         options = validate_attendees_by_id_1(namespace.options)
-        _pprint(self.client.get(
+        self.output(self.client.get(
             'expense/v2.0/attendees/{attendees id}' % options,
             ))
 
@@ -501,7 +706,7 @@ These are some commands to try.
     def do_get_type(self, namespace):
         '''Get type'''  # TODO
         options = validate_type(namespace.options)
-        _pprint(self.client.get(
+        self.output(self.client.get(
             'expense/attendee/v1.0/type' % options,
             ))
 
@@ -511,7 +716,7 @@ These are some commands to try.
     def do_get_attendees(self, namespace):
         '''Get attendees'''  # TODO
         options = validate_attendees(namespace.options)
-        _pprint(self.client.get(
+        self.output(self.client.get(
             'expense/expensereport/v2.0/report/{report id}/entry/{entry id}/attendees' % options,
             ))
 
@@ -519,7 +724,7 @@ These are some commands to try.
     def do_get_Attendees_1(self, namespace):
         '''Get Attendees_1'''  # TODO
         options = validate_Attendees_1(namespace.options)
-        _pprint(self.client.get(
+        self.output(self.client.get(
             'expense/expensereport/v2.0/report/{report id}/entry/{entry id}/Attendees' % options,
             ))
 
@@ -529,7 +734,7 @@ These are some commands to try.
     def do_post_entry(self, namespace):
         '''Post entry'''  # TODO
         options = validate_entry(namespace.options)
-        _pprint(self.client.post(
+        self.output(self.client.post(
             'expense/expensereport/v1.1/report/{report id}/entry' % options,
             RootTag=options,  # TODO
             _xmlns='http://www.concursolutions.com/api/expense/expensereport/2011/03',  # TODO
@@ -541,7 +746,7 @@ These are some commands to try.
     def do_get_Fields(self, namespace):
         '''Retrieves the details of the configured form fields for the specified form'''
         options = validate_Fields(namespace.options)
-        _pprint(self.client.get(
+        self.output(self.client.get(
             'expense/expensereport/v1.1/report/Form/%(FormId)s/Fields' % options,
             ))
 
@@ -552,7 +757,7 @@ These are some commands to try.
         '''Retrieves the list of configured form types or the configured forms for the specified form type'''
         options = validate_Forms(namespace.options)
         options.setdefault('FormCode', '')
-        _pprint(self.client.get(
+        self.output(self.client.get(
             'expense/expensereport/v1.1/report/Forms/%(FormCode)s' % options,
             ))
 
@@ -562,7 +767,7 @@ These are some commands to try.
     def do_get_expensereport_by_id(self, namespace):
         '''Get expensereport_by_id'''  # TODO
         options = validate_expensereport_by_id(namespace.options)
-        _pprint(self.client.get(
+        self.output(self.client.get(
             'expense/expensereport/v1.1/{expensereport id}' % options,
             ))
 
@@ -572,15 +777,15 @@ These are some commands to try.
     def do_get_Reports(self, namespace):
         '''Get Reports'''  # TODO
         options = validate_Reports(namespace.options)
-        _pprint(self.client.get(
-            'expense/expensereport/v2.0/Reports' % options,
-            ))
+        self.output(self.get_list(
+            'expense/expensereport/v2.0/Reports',
+            **options))
 
     @_syntax(options)
     def do_get_Reports_1(self, namespace):
         '''Get Reports_1'''  # TODO
         options = validate_Reports_1(namespace.options)
-        _pprint(self.client.get(
+        self.output(self.get_list(
             'expense/expensereport/v2.0/Reports' % options,
             ))
 
@@ -588,7 +793,7 @@ These are some commands to try.
     def do_get_Reports_2(self, namespace):
         '''Get Reports_2'''  # TODO
         options = validate_Reports_2(namespace.options)
-        _pprint(self.client.get(
+        self.output(self.get_list(
             'expense/expensereport/v2.0/Reports' % options,
             ))
 
@@ -596,7 +801,7 @@ These are some commands to try.
     def do_get_Reports_3(self, namespace):
         '''Get Reports_3'''  # TODO
         options = validate_Reports_3(namespace.options)
-        _pprint(self.client.get(
+        self.output(self.get_list(
             'expense/expensereport/v2.0/Reports' % options,
             ))
 
@@ -604,7 +809,7 @@ These are some commands to try.
     def do_get_Reports_4(self, namespace):
         '''Get Reports_4'''  # TODO
         options = validate_Reports_4(namespace.options)
-        _pprint(self.client.get(
+        self.output(self.get_list(
             'expense/expensereport/v2.0/Reports' % options,
             ))
 
@@ -612,7 +817,7 @@ These are some commands to try.
     def do_get_Reports_5(self, namespace):
         '''Get Reports_5'''  # TODO
         options = validate_Reports_5(namespace.options)
-        _pprint(self.client.get(
+        self.output(self.get_list(
             'expense/expensereport/v2.0/Reports' % options,
             ))
 
@@ -620,7 +825,7 @@ These are some commands to try.
     def do_get_Reports_6(self, namespace):
         '''Get Reports_6'''  # TODO
         options = validate_Reports_6(namespace.options)
-        _pprint(self.client.get(
+        self.output(self.get_list(
             'expense/expensereport/v2.0/Reports' % options,
             ))
 
@@ -628,7 +833,7 @@ These are some commands to try.
     def do_get_Reports_7(self, namespace):
         '''Get Reports_7'''  # TODO
         options = validate_Reports_7(namespace.options)
-        _pprint(self.client.get(
+        self.output(self.get_list(
             'expense/expensereport/v2.0/Reports' % options,
             ))
 
@@ -636,7 +841,7 @@ These are some commands to try.
     def do_get_Reports_8(self, namespace):
         '''Get Reports_8'''  # TODO
         options = validate_Reports_8(namespace.options)
-        _pprint(self.client.get(
+        self.output(self.get_list(
             'expense/expenserepo/v2.0/Reports' % options,
             ))
 
@@ -644,7 +849,7 @@ These are some commands to try.
     def do_get_report_by_id(self, namespace):
         '''Get report_by_id'''  # TODO
         options = validate_report_by_id(namespace.options)
-        _pprint(self.client.get(
+        self.output(self.client.get(
             'expense/expensereport/v2.0/report/{report id}' % options,
             ))
 
@@ -654,7 +859,7 @@ These are some commands to try.
     def do_post_Exceptions(self, namespace):
         '''Post Exceptions'''  # TODO
         options = validate_Exceptions(namespace.options)
-        _pprint(self.client.post(
+        self.output(self.client.post(
             'expense/expensereport/v1.1/report/{report id}/Exceptions' % options,
             RootTag=options,  # TODO
             _xmlns='http://www.concursolutions.com/api/expense/expensereport/2011/03',  # TODO
@@ -664,7 +869,7 @@ These are some commands to try.
     def do_post_submit(self, namespace):
         '''Post submit'''  # TODO
         options = validate_submit(namespace.options)
-        _pprint(self.client.post(
+        self.output(self.client.post(
             'expense/expensereport/v1.1/report/{report id}/submit' % options,
             RootTag=options,  # TODO
             _xmlns='http://www.concursolutions.com/api/expense/expensereport/2011/03',  # TODO
@@ -674,7 +879,7 @@ These are some commands to try.
     def do_post_workflowaction(self, namespace):
         '''Post workflowaction'''  # TODO
         options = validate_workflowaction(namespace.options)
-        _pprint(self.client.post(
+        self.output(self.client.post(
             'expense/expensereport/v1.1/report/{report id}/workflowaction' % options,
             RootTag=options,  # TODO
             _xmlns='http://www.concursolutions.com/api/expense/expensereport/2011/03',  # TODO
@@ -686,7 +891,7 @@ These are some commands to try.
     def do_post_report_by_id(self, namespace):
         '''Post report_by_id'''  # TODO
         options = validate_report_by_id(namespace.options)
-        _pprint(self.client.post(
+        self.output(self.client.post(
             'expense/expensereport/v2.0/integrationstatus/report/{report id}' % options,
             RootTag=options,  # TODO
             _xmlns='http://www.concursolutions.com/api/expense/expensereport/2011/03',  # TODO
@@ -698,7 +903,7 @@ These are some commands to try.
     def do_get_expensereport_by_id_1(self, namespace):
         '''Get expensereport_by_id_1'''  # TODO
         options = validate_expensereport_by_id_1(namespace.options)
-        _pprint(self.client.get(
+        self.output(self.client.get(
             'expense/expensereport/v1.1/{expensereport id}' % options,
             ))
 
@@ -708,7 +913,7 @@ These are some commands to try.
     def do_get_v10(self, namespace):
         '''Get v1.0'''  # TODO
         options = validate_v10(namespace.options)
-        _pprint(self.client.get(
+        self.output(self.client.get(
             'expense/extract/v1.0' % options,
             ))
 
@@ -716,7 +921,7 @@ These are some commands to try.
     def do_get_extract_by_id(self, namespace):
         '''Get extract_by_id'''  # TODO
         options = validate_extract_by_id(namespace.options)
-        _pprint(self.client.get(
+        self.output(self.client.get(
             'expense/extract/v1.0/{extract id}' % options,
             ))
 
@@ -726,7 +931,7 @@ These are some commands to try.
     def do_get_file(self, namespace):
         '''Get file'''  # TODO
         options = validate_file(namespace.options)
-        _pprint(self.client.get(
+        self.output(self.client.get(
             'expense/extract/v1.0/{extract id}/job/{job id}/file' % options,
             ))
 
@@ -736,7 +941,7 @@ These are some commands to try.
     def do_get_job(self, namespace):
         '''Get job'''  # TODO
         options = validate_job(namespace.options)
-        _pprint(self.client.get(
+        self.output(self.client.get(
             'expense/extract/v1.0/{extract id}/job' % options,
             ))
 
@@ -744,7 +949,7 @@ These are some commands to try.
     def do_get_job_by_id(self, namespace):
         '''Get job_by_id'''  # TODO
         options = validate_job_by_id(namespace.options)
-        _pprint(self.client.get(
+        self.output(self.client.get(
             'expense/extract/v1.0/{extract id}/job/{job id}' % options,
             ))
 
@@ -752,7 +957,7 @@ These are some commands to try.
     def do_get_status(self, namespace):
         '''Get status'''  # TODO
         options = validate_status(namespace.options)
-        _pprint(self.client.get(
+        self.output(self.client.get(
             'expense/extract/v1.0/{extract id}/job/{job id}/status' % options,
             ))
 
@@ -762,7 +967,7 @@ These are some commands to try.
     def do_post_job(self, namespace):
         '''Post job'''  # TODO
         options = validate_job(namespace.options)
-        _pprint(self.client.post(
+        self.output(self.client.post(
             'expense/extract/v1.0/{extract id}/job' % options,
             RootTag=options,  # TODO
             _xmlns='http://www.concursolutions.com/api/expense/expensereport/2011/03',  # TODO
@@ -774,7 +979,7 @@ These are some commands to try.
     def do_post_receipt(self, namespace):
         '''Post receipt'''  # TODO
         options = validate_receipt(namespace.options)
-        _pprint(self.client.post(
+        self.output(self.client.post(
             'image/v1.0/receipt' % options,
             RootTag=options,  # TODO
             _xmlns='http://www.concursolutions.com/api/expense/expensereport/2011/03',  # TODO
@@ -784,7 +989,7 @@ These are some commands to try.
     def do_post_expenseentry_by_id(self, namespace):
         '''Post expenseentry_by_id'''  # TODO
         options = validate_expenseentry_by_id(namespace.options)
-        _pprint(self.client.post(
+        self.output(self.client.post(
             'image/v1.0/expenseentry/{expenseentry id}' % options,
             RootTag=options,  # TODO
             _xmlns='http://www.concursolutions.com/api/expense/expensereport/2011/03',  # TODO
@@ -794,7 +999,7 @@ These are some commands to try.
     def do_post_invoice_by_id(self, namespace):
         '''Post invoice_by_id'''  # TODO
         options = validate_invoice_by_id(namespace.options)
-        _pprint(self.client.post(
+        self.output(self.client.post(
             'image/v1.1/invoice/{invoice id}' % options,
             RootTag=options,  # TODO
             _xmlns='http://www.concursolutions.com/api/expense/expensereport/2011/03',  # TODO
@@ -804,7 +1009,7 @@ These are some commands to try.
     def do_post_report_by_id_1(self, namespace):
         '''Post report_by_id_1'''  # TODO
         options = validate_report_by_id_1(namespace.options)
-        _pprint(self.client.post(
+        self.output(self.client.post(
             'image/v1.0/report/{report id}' % options,
             RootTag=options,  # TODO
             _xmlns='http://www.concursolutions.com/api/expense/expensereport/2011/03',  # TODO
@@ -816,7 +1021,7 @@ These are some commands to try.
     def do_get_receipt_by_id(self, namespace):
         '''Get receipt_by_id'''  # TODO
         options = validate_receipt_by_id(namespace.options)
-        _pprint(self.client.get(
+        self.output(self.client.get(
             'image/v1.0/receipt/{receipt id}' % options,
             ))
 
@@ -824,7 +1029,7 @@ These are some commands to try.
     def do_get_report_by_id_1(self, namespace):
         '''Get report_by_id_1'''  # TODO
         options = validate_report_by_id_1(namespace.options)
-        _pprint(self.client.get(
+        self.output(self.client.get(
             'image/v1.0/report/{report id}' % options,
             ))
 
@@ -832,7 +1037,7 @@ These are some commands to try.
     def do_get_expenseentry_by_id(self, namespace):
         '''Get expenseentry_by_id'''  # TODO
         options = validate_expenseentry_by_id(namespace.options)
-        _pprint(self.client.get(
+        self.output(self.client.get(
             'image/v1.0/expenseentry/{expenseentry id}' % options,
             ))
 
@@ -840,7 +1045,7 @@ These are some commands to try.
     def do_get_invoice_by_id(self, namespace):
         '''Get invoice_by_id'''  # TODO
         options = validate_invoice_by_id(namespace.options)
-        _pprint(self.client.get(
+        self.output(self.client.get(
             'image/v1.0/invoice/{invoice id}' % options,
             ))
 
@@ -850,7 +1055,7 @@ These are some commands to try.
     def do_get_quickexpense(self, namespace):
         '''Get quickexpense'''  # TODO
         options = validate_quickexpense(namespace.options)
-        _pprint(self.client.get(
+        self.output(self.client.get(
             'expense/expensereport/v1.0/quickexpense' % options,
             ))
 
@@ -860,7 +1065,7 @@ These are some commands to try.
     def do_post_quickexpense(self, namespace):
         '''Post quickexpense'''  # TODO
         options = validate_quickexpense(namespace.options)
-        _pprint(self.client.post(
+        self.output(self.client.post(
             'expense/expensereport/v1.0/quickexpense' % options,
             RootTag=options,  # TODO
             _xmlns='http://www.concursolutions.com/api/expense/expensereport/2011/03',  # TODO
@@ -870,7 +1075,7 @@ These are some commands to try.
     def do_post_quickexpense_1(self, namespace):
         '''Post quickexpense_1'''  # TODO
         options = validate_quickexpense_1(namespace.options)
-        _pprint(self.client.post(
+        self.output(self.client.post(
             'expense/expensereport/v1.0/quickexpense' % options,
             RootTag=options,  # TODO
             _xmlns='http://www.concursolutions.com/api/expense/expensereport/2011/03',  # TODO
@@ -879,9 +1084,37 @@ These are some commands to try.
 
 def main(argv=None):
     if argv is None:
-        import sys
         argv = sys.argv[1:]
-    ConcurCmd().cmdloop()
+    parser = ArgumentParser(
+        prog='concur_cli',
+        description='A command line interpreter for the Concur API.',
+        )
+    parser.add_argument('--batch', metavar='FILE',
+                        help="run the commands in FILE ('-' for stdin) and exit")
+    parser.add_argument('--workers', type=int, default=1,
+                        help='number of commands to run at once')
+    parser.add_argument('--format', choices=ConcurCmd.formats,
+                        default='pprint', help='output format')
+    parser.add_argument('--fields', help='comma-separated fields to output')
+    parser.add_argument('--prefer-json', action='store_true',
+                        help='ask the API for JSON, which can be streamed')
+    parser.add_argument('--tag', action='store_true',
+                        help='print output as each command finishes, '
+                             'prefixed with its line number')
+    args = parser.parse_args(argv)
+    cli = ConcurCmd()
+    cli.workers = args.workers
+    cli.format = args.format
+    if args.fields:
+        cli.fields = args.fields.split(',')
+    cli.client.prefer_json = args.prefer_json
+    if args.batch is None:
+        cli.cmdloop()
+    elif args.batch == '-':
+        cli.run_batch(sys.stdin, args.workers, args.tag)
+    else:
+        with open(args.batch) as script:
+            cli.run_batch(script, args.workers, args.tag)
 
 if __name__ == '__main__':
     main()